@@ -0,0 +1,245 @@
+import json
+import os
+import geopandas as gpd
+import numpy as np
+import shapely
+from shapely.geometry import LineString, Point
+
+SECTIONS_LAYER = 'sections'
+INTERSECTIONS_LAYER = 'intersections'
+
+def export_road_sections(
+    roadstrings,
+    intersections,
+    filepath,
+    batch_size=10000,
+):
+    """
+    Save the sections and intersections from convert_to_linestrings to disk
+    with a spatial index, so later jobs can read just the area they need
+    instead of rebuilding them from OSM. Rows are written a batch at a time,
+    so the geometry of the whole region is never held in memory at once.
+    Rows are written in the order of a Hilbert curve through their centers,
+    so each batch covers a small area and its bbox tells readers what to skip.
+
+    A .gpkg file gets a 'sections' and an 'intersections' layer, each with an
+    R-tree. A .parquet file is written as GeoParquet with a bbox column that
+    readers use to skip row groups; the intersections go next to it in a file
+    ending in '_intersections.parquet'.
+
+    Parameters
+    ----------
+    roadstrings : {roadname : [[[section1, section2]]]}
+        the road sections returned by convert_to_linestrings
+    intersections : {roadname: [[road1], [road2]]}
+        the intersections returned by convert_to_linestrings
+    filepath : string or pathlib.Path
+        where to save, ending in .gpkg or .parquet
+    batch_size : int
+        how many rows to write at a time, and the row group size of GeoParquet
+
+    Returns
+    -------
+    list of the files written
+    """
+    filepath = str(filepath)
+    if filepath.endswith('.gpkg'):
+        if os.path.exists(filepath):
+            os.unlink(filepath)
+        _write_geopackage(_section_rows(roadstrings), filepath, SECTIONS_LAYER, batch_size)
+        _write_geopackage(_intersection_rows(intersections), filepath, INTERSECTIONS_LAYER, batch_size)
+        return [filepath]
+    if filepath.endswith('.parquet'):
+        intersections_path = _intersections_path(filepath)
+        _write_geoparquet(_section_rows(roadstrings), filepath, 'LineString', batch_size)
+        _write_geoparquet(_intersection_rows(intersections), intersections_path, 'Point', batch_size)
+        return [filepath, intersections_path]
+    raise ValueError('filepath must end in .gpkg or .parquet, not %r' % filepath)
+
+def read_road_sections(
+    filepath,
+    north=None,
+    south=None,
+    east=None,
+    west=None,
+    layer=SECTIONS_LAYER,
+):
+    """
+    Read the sections or intersections saved by export_road_sections, using
+    the spatial index to read only those inside a bounding box.
+
+    Parameters
+    ----------
+    filepath : string or pathlib.Path
+        the file given to export_road_sections
+    north : float
+        northern latitude of bounding box
+    south : float
+        southern latitude of bounding box
+    east : float
+        eastern longitude of bounding box
+    west : float
+        western longitude of bounding box
+    layer : string {"sections", "intersections"}
+        which of the two to read
+
+    Returns
+    -------
+    geopandas.GeoDataFrame with 'road', 'group' and 'index' columns, where
+    group is which road of that name the row is on and index is the position
+    of the section or intersection along it
+    """
+    filepath = str(filepath)
+    bbox = None if north is None else (west, south, east, north)
+    if filepath.endswith('.gpkg'):
+        return gpd.read_file(filepath, layer=layer, bbox=bbox)
+    if filepath.endswith('.parquet'):
+        import pyarrow.dataset as ds
+        if layer == INTERSECTIONS_LAYER:
+            filepath = _intersections_path(filepath)
+        condition = None
+        if bbox is not None:
+            #Row groups whose bbox statistics miss the box are skipped unread
+            condition = (
+                (ds.field('bbox', 'xmax') >= west) & (ds.field('bbox', 'xmin') <= east)
+                & (ds.field('bbox', 'ymax') >= south) & (ds.field('bbox', 'ymin') <= north)
+            )
+        table = ds.dataset(filepath, format='parquet').to_table(
+            columns=['road', 'group', 'index', 'geometry'], filter=condition,
+        )
+        frame = table.to_pandas()
+        geometry = shapely.from_wkb(frame.pop('geometry').values)
+        return gpd.GeoDataFrame(frame, geometry=geometry, crs='epsg:4326')
+    raise ValueError('filepath must end in .gpkg or .parquet, not %r' % filepath)
+
+def _section_rows(roadstrings):
+    """
+    Yield one row for every section of road, with its geometry in (lon, lat),
+    in spatial order.
+    """
+    places = []
+    for road in roadstrings:
+        for group, sections in enumerate(roadstrings[road]):
+            for index, section in enumerate(sections):
+                if len(section) < 2:
+                    continue
+                lats = [point[0] for point in section]
+                lons = [point[1] for point in section]
+                places.append(((min(lons) + max(lons)) / 2, (min(lats) + max(lats)) / 2, road, group, index))
+    for road, group, index in _spatial_order(places):
+        section = roadstrings[road][group][index]
+        yield {'road': road, 'group': group, 'index': index,
+               'geometry': LineString([(lon, lat) for lat, lon in section])}
+
+def _intersection_rows(intersections):
+    """
+    Yield one row for every intersection of every road, in spatial order.
+    """
+    places = []
+    for road in intersections:
+        for group, points in enumerate(intersections[road]):
+            for index, (lat, lon) in enumerate(points):
+                places.append((lon, lat, road, group, index))
+    for road, group, index in _spatial_order(places):
+        lat, lon = intersections[road][group][index]
+        yield {'road': road, 'group': group, 'index': index, 'geometry': Point(lon, lat)}
+
+def _spatial_order(places, order=16):
+    """
+    Sort (x, y, road, group, index) tuples along a Hilbert curve through the
+    extent of their (x, y), so that rows near each other on the map end up
+    near each other in the file. Returns the (road, group, index) of each.
+    """
+    if len(places) == 0:
+        return []
+    side = 1 << order
+    xy = np.array([place[:2] for place in places], dtype=float)
+    low = xy.min(axis=0)
+    span = np.maximum(xy.max(axis=0) - low, 1e-12)
+    cells = np.minimum((xy - low) / span * side, side - 1).astype(np.int64)
+    x, y = cells[:, 0], cells[:, 1]
+    keys = np.zeros(len(places), dtype=np.int64)
+    s = side // 2
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        keys += s * s * ((3 * rx) ^ ry)
+        #Rotate the quadrant so the curve stays continuous at the next level
+        flip = ~ry & rx
+        x = np.where(flip, side - 1 - x, x)
+        y = np.where(flip, side - 1 - y, y)
+        x, y = np.where(~ry, y, x), np.where(~ry, x, y)
+        s //= 2
+    return [places[i][2:] for i in np.argsort(keys, kind='stable')]
+
+def _batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch):
+        yield batch
+
+def _write_geopackage(rows, filepath, layer, batch_size):
+    """
+    Append rows to a GeoPackage layer a batch at a time. GDAL builds the R-tree
+    of the layer as the rows go in. A layer with no rows is still created, so
+    it can be read back.
+    """
+    first = True
+    for batch in _batches(rows, batch_size):
+        frame = gpd.GeoDataFrame(batch, geometry='geometry', crs='epsg:4326')
+        frame.to_file(filepath, layer=layer, driver='GPKG', mode='w' if first else 'a', SPATIAL_INDEX='YES')
+        first = False
+    if first:
+        frame = gpd.GeoDataFrame(
+            {'road': np.array([], dtype=object), 'group': np.array([], dtype=np.int64), 'index': np.array([], dtype=np.int64)},
+            geometry=gpd.GeoSeries([], crs='epsg:4326'),
+        )
+        frame.to_file(filepath, layer=layer, driver='GPKG', SPATIAL_INDEX='YES')
+
+def _write_geoparquet(rows, filepath, geometry_type, batch_size):
+    """
+    Write rows to GeoParquet one row group per batch, with a bbox column
+    covering each geometry as in GeoParquet 1.1.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    geo = {
+        'version': '1.1.0',
+        'primary_column': 'geometry',
+        'columns': {'geometry': {
+            'encoding': 'WKB',
+            'geometry_types': [geometry_type],
+            'covering': {'bbox': {
+                'xmin': ['bbox', 'xmin'], 'ymin': ['bbox', 'ymin'],
+                'xmax': ['bbox', 'xmax'], 'ymax': ['bbox', 'ymax'],
+            }},
+        }},
+    }
+    schema = pa.schema([
+        ('road', pa.string()),
+        ('group', pa.int32()),
+        ('index', pa.int32()),
+        ('bbox', pa.struct([(name, pa.float64()) for name in ('xmin', 'ymin', 'xmax', 'ymax')])),
+        ('geometry', pa.binary()),
+    ], metadata={b'geo': json.dumps(geo).encode()})
+    with pq.ParquetWriter(filepath, schema) as writer:
+        for batch in _batches(rows, batch_size):
+            geometries = [row['geometry'] for row in batch]
+            bounds = shapely.bounds(geometries)
+            table = pa.table({
+                'road': [row['road'] for row in batch],
+                'group': [row['group'] for row in batch],
+                'index': [row['index'] for row in batch],
+                'bbox': pa.StructArray.from_arrays(
+                    [pa.array(bounds[:, i]) for i in range(4)], names=['xmin', 'ymin', 'xmax', 'ymax']
+                ),
+                'geometry': shapely.to_wkb(geometries),
+            }, schema=schema)
+            writer.write_table(table, row_group_size=batch_size)
+
+def _intersections_path(filepath):
+    return filepath[:-len('.parquet')] + '_intersections.parquet'
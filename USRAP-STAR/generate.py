@@ -2,7 +2,10 @@ from math import trunc
 import string
 import networkx as nx
 import osmnx as ox
+from shapely.geometry import LineString
 import copy
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 def generate_graph_from_place(
     query, 
@@ -75,7 +78,7 @@ def generate_graph_from_place(
         clean_periphery=clean_periphery, 
         custom_filter=custom_filter,
     )
-    graph = ox.get_undirected(ox.get_digraph(graph))
+    graph = to_undirected(graph)
     #Remove edges that do not have their name in road_list
     if road_list:
         graph = _isolate_road(graph, road_list)
@@ -150,7 +153,7 @@ def generate_graph_from_address(
         clean_periphery=clean_periphery, 
         custom_filter=custom_filter,
     )
-    graph = ox.get_undirected(ox.get_digraph(graph))
+    graph = to_undirected(graph)
     #Remove edges that do not have their name in road_list
     if road_list:
         graph = _isolate_road(graph, road_list)
@@ -220,7 +223,7 @@ def generate_graph_from_bbox(
         clean_periphery=clean_periphery, 
         custom_filter=custom_filter,
     )
-    graph = ox.get_undirected(ox.get_digraph(graph))
+    graph = to_undirected(graph)
     #Remove edges that do not have their name in road_list
     if road_list:
         graph = _isolate_road(graph, road_list)
@@ -290,7 +293,7 @@ def generate_graph_from_point(
         clean_periphery=clean_periphery, 
         custom_filter=custom_filter,
     )
-    graph = ox.get_undirected(ox.get_digraph(graph))
+    graph = to_undirected(graph)
     #Remove edges that do not have their name in road_list
     if road_list:
         graph = _isolate_road(graph, road_list)
@@ -349,7 +352,7 @@ def generate_graph_from_polygon(
         clean_periphery=clean_periphery, 
         custom_filter=custom_filter,
     )
-    graph = ox.get_undirected(ox.get_digraph(graph))
+    graph = to_undirected(graph)
     #Remove edges that do not have their name in road_list
     if road_list:
         graph = _isolate_road(graph, road_list)
@@ -390,12 +393,167 @@ def generate_graph_from_xml_file(
         simplify=simplify, 
         retain_all=retain_all,
     )
-    graph = ox.get_undirected(ox.get_digraph(graph))
+    graph = to_undirected(graph)
     #Remove edges that do not have their name in road_list
     if road_list:
         graph = _isolate_road(graph, road_list)
     return graph
 
+_BUILDERS = {
+    'place': generate_graph_from_place,
+    'address': generate_graph_from_address,
+    'bbox': generate_graph_from_bbox,
+    'point': generate_graph_from_point,
+    'polygon': generate_graph_from_polygon,
+    'xml_file': generate_graph_from_xml_file,
+}
+
+def generate_graphs(
+    queries,
+    source='place',
+    max_workers=None,
+    settings=None,
+    return_exceptions=False,
+    **kwargs,
+):
+    """
+    Create graphs for many queries at once, yielding each graph as soon as it
+    is done. Every query runs in its own process from a pool larger than the
+    number of cores, so while some processes wait on OSM downloads others are
+    busy building and simplifying their graphs.
+
+    Parameters
+    ----------
+    queries : list
+        the queries to build graphs for. each query is either a dict of keyword
+        arguments, a tuple of positional arguments, or the first argument on its
+        own, for the generate_graph_from_* function named by source
+    source : string {"place", "address", "bbox", "point", "polygon", "xml_file"}
+        which generate_graph_from_* function to build each graph with
+    max_workers : int
+        how many queries to run at once, twice the number of cores if not specified
+    settings : dict
+        osmnx settings to apply in every process, e.g. {'use_cache': True,
+        'cache_folder': 'tests/cache'} to serve downloads from a cache folder
+    return_exceptions : bool
+        if True, a query that fails yields its exception in place of a graph,
+        otherwise the exception is raised
+    kwargs
+        keyword arguments passed to every call, e.g. network_type or road_list
+
+    Yields
+    ------
+    (query, graph) : the query as given, and its networkx.MultiDiGraph, in the
+    order they finish
+    """
+    builder = _BUILDERS[source]
+    if max_workers is None:
+        max_workers = 2 * (os.cpu_count() or 1)
+    executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_apply_settings, initargs=(settings,))
+    try:
+        futures = {}
+        for query in queries:
+            if isinstance(query, dict):
+                future = executor.submit(builder, **dict(kwargs, **query))
+            elif isinstance(query, tuple):
+                future = executor.submit(builder, *query, **kwargs)
+            else:
+                future = executor.submit(builder, query, **kwargs)
+            futures[future] = query
+        for future in as_completed(futures):
+            try:
+                graph = future.result()
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                graph = e
+            yield futures[future], graph
+    finally:
+        #Stopping early, by an error or the caller, should not wait for the queries left
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def to_undirected(
+    graph,
+    weight='length',
+):
+    """
+    Convert a graph to an undirected networkx.MultiGraph in a single pass,
+    giving the same graph as ox.get_undirected(ox.get_digraph(graph)) without
+    building the two copies in between. Of parallel edges running the same
+    way only the one with the smallest weight is kept, and an edge and its
+    reverse become one undirected edge when they have the same osmid and the
+    same geometry in either direction. Edge attributes are copied shallowly,
+    so the geometries are shared with the input graph rather than duplicated.
+
+    Parameters
+    ----------
+    graph : networkx.MultiDiGraph
+        input graph
+    weight : string
+        the edge attribute to minimize when choosing between parallel edges
+
+    Returns
+    -------
+    graph : networkx.MultiGraph
+    """
+    undirected = nx.MultiGraph(**graph.graph)
+    undirected.add_nodes_from(graph.nodes(data=True))
+    nodes = graph.nodes
+    multigraph = graph.is_multigraph()
+    directed = graph.is_directed()
+    for u, neighbors in graph.adjacency():
+        for v, edges in neighbors.items():
+            if not multigraph:
+                data = edges
+            elif len(edges) == 1:
+                data = next(iter(edges.values()))
+            else:
+                data = min(edges.values(), key=lambda d: d[weight])
+            #The reverse edge, or the same edge seen from v in an undirected graph
+            existing = undirected.get_edge_data(u, v)
+            if existing and any(_is_same_edge(nodes, u, v, data, other) for other in existing.values()):
+                continue
+            data = dict(data)
+            #An undirected input already knows which way its edges were drawn
+            if directed or 'from' not in data:
+                data['from'] = u
+                data['to'] = v
+            if 'geometry' not in data:
+                data['geometry'] = LineString([(nodes[u]['x'], nodes[u]['y']), (nodes[v]['x'], nodes[v]['y'])])
+            undirected.add_edge(u, v, **data)
+    return undirected
+
+def _is_same_edge(nodes, u, v, data, other):
+    """
+    Check whether the edge data from u to v and the data of an edge already in
+    the undirected graph have the same osmid and geometry, in either direction.
+    """
+    osmid = data.get('osmid')
+    other_osmid = other.get('osmid')
+    #Simplified edges hold lists of osmids, which may be in either order
+    if isinstance(osmid, list):
+        osmid = set(osmid)
+    if isinstance(other_osmid, list):
+        other_osmid = set(other_osmid)
+    if osmid != other_osmid:
+        return False
+    geometry = data.get('geometry')
+    if geometry is other['geometry']:
+        return True
+    if geometry is None:
+        coords = [(nodes[u]['x'], nodes[u]['y']), (nodes[v]['x'], nodes[v]['y'])]
+    else:
+        coords = list(geometry.coords)
+    other_coords = list(other['geometry'].coords)
+    return coords == other_coords or coords[::-1] == other_coords
+
+def _apply_settings(settings):
+    """
+    Apply osmnx settings in a worker process.
+    """
+    for name, value in (settings or {}).items():
+        setattr(ox.settings, name, value)
+
 def _isolate_road(
     graph, 
     road,
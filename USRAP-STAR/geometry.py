@@ -1,12 +1,21 @@
 import networkx as nx
+import numpy as np
 import osmnx as ox
 from shapely.geometry import LineString
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import copy
+import hashlib
+import os
+import pickle
+import shapely
+import road_index
 
 def make_road_list(graph):
     """
-    Make a graph that only contains 1 road name for road in the system.
+    Make a graph that only contains 1 road name for road in the system. The
+    graph is scanned once to build a road_index, and each road is then taken
+    from the edges the index holds for its name, rather than from a copy of
+    the whole graph.
 
     Parameters
     ----------
@@ -18,18 +27,50 @@ def make_road_list(graph):
     dictionary with the key being a road name, and the value is a Netowrkx.Graph
     of all edges with that road name
     """
+    index = road_index.build_road_index(graph, fields=('name',))
     roads = set()
-    for i in graph:
-        for j in graph[i]:
-            if graph[i][j][0].get('name') and type(graph[i][j][0].get('name')) == list:
-                for k in graph[i][j][0]['name']:
-                    roads.add(k)
-            elif graph[i][j][0].get('name') and type(graph[i][j][0].get('name')) == str:
-                roads.add(graph[i][j][0].get('name'))
-    return {i:_isolate_road(graph, i) for i in roads} 
+    for _, _, name in graph.edges(data='name'):
+        if type(name) == list:
+            roads.update(name)
+        elif type(name) == str:
+            roads.add(name)
+    position = {node: n for n, node in enumerate(graph)}
+    road_list = {}
+    for i in roads:
+        #The index matches every way of writing the name, so keep only this one
+        edges = set(
+            (u, v, k) for u, v, k in road_index.find_road_edges(index, i)
+            if _has_name(graph.edges[u, v, k].get('name'), i)
+        )
+        road_list[i] = _road_subgraph(graph, edges, position)
+    return road_list
+
+def _has_name(names, road):
+    if type(names) == list:
+        return road in names
+    return names == road
+
+def _road_subgraph(graph, edges, position):
+    """
+    Copy some edges of a graph out into a graph of their own. Nodes, and the
+    neighbours of each node, keep the order they have in the graph, so the
+    road is walked the same way as it was when it was cut out of a full copy.
+    """
+    road = graph.__class__()
+    road.graph.update(graph.graph)
+    nodes = sorted(set(u for u, _, _ in edges) | set(v for _, v, _ in edges), key=position.__getitem__)
+    road.add_nodes_from((node, graph.nodes[node]) for node in nodes)
+    for u in nodes:
+        for v, keys in graph[u].items():
+            for k, data in keys.items():
+                if (u, v, k) in edges or (not graph.is_directed() and (v, u, k) in edges):
+                    road.add_edge(u, v, k, **data)
+    return road
 
 def convert_to_linestrings(
-    roads
+    roads,
+    use_cache=False,
+    cache_dir=None,
 ):
     """
     Creates a Linestring for each of the roads, or a certain list of roads
@@ -39,6 +80,12 @@ def convert_to_linestrings(
     Parameters
     ----------
     roads : a dictionary with road name as key, and Networkx.MultiDiGraph as value
+    use_cache : bool
+        if True, reuse the sections and intersections of any road graph that
+        has already been converted, keyed by graph_fingerprint
+    cache_dir : string or pathlib.Path
+        if specified along with use_cache, also keep converted roads on disk
+        in this directory so they survive between sessions
     
     Returns
     ----------
@@ -52,42 +99,281 @@ def convert_to_linestrings(
     roadstrings = defaultdict(list)
     intersections = defaultdict(list)
     for i in roads:
-        endpoints = find_end_nodes(roads[i])
-        while len(endpoints):
-            node = endpoints[0]
-            visited = set()
-            visited.add(node)
-            frontier = [(node, None)]
-            path = []
-            paths = []
-            intersection = []
-            while len(frontier):
-                node, prev = frontier.pop()
-                node_found = False
-                if len(path) == 0 and prev:
-                    path.append((roads[i].nodes[prev]['y'], roads[i].nodes[prev]['x']))
-                if prev and roads[i][prev][node][0].get('geometry'):
-                    for j, coords in enumerate(roads[i][prev][node][0]['geometry'].coords):
-                        if j > 0:
-                            path.append((coords[1], coords[0]))
-                else:
-                    path.append((roads[i].nodes[node]['y'], roads[i].nodes[node]['x']))
-                    intersection.append((roads[i].nodes[node]['y'], roads[i].nodes[node]['x']))
-                for j in roads[i][node]:
-                    if j not in visited:
-                        visited.add(j)
-                        frontier.append((j, node))
-                        node_found = True
-                if node_found == False:
-                    paths.append(path[:])
-                    path = []
-            roadstrings[i].append(paths[:])
-            intersections[i].append(intersection[:])
-            for j in endpoints:
-                if j in visited:
-                    endpoints.remove(j)
+        if use_cache:
+            sections, intersection = _cached_road_linestrings(roads[i], cache_dir)
+            #Hand out lists, as a fresh conversion does, so the cached tuples stay untouched
+            sections = [[list(path) for path in paths] for paths in sections]
+            intersection = [list(points) for points in intersection]
+        else:
+            sections, intersection = _road_linestrings(roads[i])
+        if len(sections):
+            roadstrings[i].extend(sections)
+            intersections[i].extend(intersection)
     return roadstrings, intersections
-    
+
+def _road_linestrings(graph):
+    """
+    Walk the graph of a single road from each of its end nodes, and collect
+    the sections and intersections found along the way.
+
+    Parameters
+    ----------
+    graph : Networkx.MultiDiGraph
+        the graph of a single road
+
+    Returns
+    ----------
+    (sections, intersections) of the road, in the format of a single value of
+    the dictionaries returned by convert_to_linestrings
+    """
+    sections = []
+    intersections = []
+    endpoints = find_end_nodes(graph)
+    while len(endpoints):
+        node = endpoints[0]
+        visited = set()
+        visited.add(node)
+        frontier = [(node, None)]
+        path = []
+        paths = []
+        intersection = []
+        while len(frontier):
+            node, prev = frontier.pop()
+            node_found = False
+            if len(path) == 0 and prev:
+                path.append((graph.nodes[prev]['y'], graph.nodes[prev]['x']))
+            #A road can be on any one of several parallel edges, not only the first
+            data = graph[prev][node][min(graph[prev][node])] if prev else None
+            if prev and data.get('geometry'):
+                for j, coords in enumerate(data['geometry'].coords):
+                    if j > 0:
+                        path.append((coords[1], coords[0]))
+            else:
+                path.append((graph.nodes[node]['y'], graph.nodes[node]['x']))
+                intersection.append((graph.nodes[node]['y'], graph.nodes[node]['x']))
+            for j in graph[node]:
+                if j not in visited:
+                    visited.add(j)
+                    frontier.append((j, node))
+                    node_found = True
+            if node_found == False:
+                paths.append(path[:])
+                path = []
+        sections.append(paths[:])
+        intersections.append(intersection[:])
+        #Removing from the list while looping over it skipped endpoints, which then walked the road again
+        endpoints = [j for j in endpoints if j not in visited]
+    return sections, intersections
+
+def graph_fingerprint(graph):
+    """
+    Identify a road graph by its crs, the coordinates of its nodes, and the
+    endpoints, osmids and geometry of its edges, so that a graph rebuilt from
+    the same OSM data gets the same fingerprint in a later session, and a
+    graph that was moved or projected gets a different one.
+
+    Parameters
+    ----------
+    graph : Networkx.MultiDiGraph
+        input graph
+
+    Returns
+    ----------
+    hex digest string identifying the graph
+    """
+    nodes = sorted(graph.nodes)
+    coords = np.array([(graph.nodes[n]['x'], graph.nodes[n]['y']) for n in nodes], dtype=float)
+    edges = []
+    for u, v, data in graph.edges(data=True):
+        osmid = data.get('osmid')
+        osmid = tuple(sorted(osmid)) if isinstance(osmid, list) else (osmid,)
+        #Undirected graphs may report an edge from either end
+        edges.append((u, v, osmid, data.get('geometry')) if u <= v else (v, u, osmid, data.get('geometry')))
+    edges.sort(key=lambda edge: edge[:3])
+    fingerprint = hashlib.sha1(repr((str(graph.graph.get('crs')), nodes)).encode())
+    fingerprint.update(coords.tobytes())
+    fingerprint.update(repr([(u, v, osmid, geometry is not None) for u, v, osmid, geometry in edges]).encode())
+    fingerprint.update(_geometry_coords([edge[3] for edge in edges if edge[3] is not None]).tobytes())
+    return fingerprint.hexdigest()
+
+def _geometry_coords(geometries):
+    """
+    Get the coordinates of a list of LineStrings, each starting with how many
+    points it has, as one float array.
+    """
+    if len(geometries) == 0:
+        return np.zeros(0)
+    if hasattr(shapely, 'get_coordinates'):
+        #Shapely 2 reads every geometry in one call
+        points, index = shapely.get_coordinates(np.array(geometries, dtype=object), return_index=True)
+        counts = np.bincount(index, minlength=len(geometries))
+    else:
+        points = np.concatenate([np.asarray(geometry.coords)[:, :2] for geometry in geometries])
+        counts = np.array([len(geometry.coords) for geometry in geometries])
+    return np.concatenate([counts.astype(float), points.ravel()])
+
+#Converted roads kept in memory by graph fingerprint, least recently used first
+_linestring_cache = OrderedDict()
+linestring_cache_size = 1024
+
+def _cached_road_linestrings(graph, cache_dir=None):
+    """
+    Look up the sections and intersections of a road graph in the memory
+    cache, then the disk cache, converting the graph only if both miss.
+    """
+    key = graph_fingerprint(graph)
+    if key in _linestring_cache:
+        _linestring_cache.move_to_end(key)
+        return _linestring_cache[key]
+    result = None
+    if cache_dir:
+        path = os.path.join(cache_dir, key + '.pkl')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+    if result is None:
+        sections, intersections = _road_linestrings(graph)
+        #Frozen so that nothing done with a hit can change what is cached
+        result = (
+            tuple(tuple(tuple(path) for path in paths) for paths in sections),
+            tuple(tuple(intersection) for intersection in intersections),
+        )
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            temp_path = '%s.%d.tmp' % (path, os.getpid())
+            with open(temp_path, 'wb') as f:
+                pickle.dump(result, f)
+            os.replace(temp_path, path)
+    _linestring_cache[key] = result
+    while len(_linestring_cache) > linestring_cache_size:
+        _linestring_cache.popitem(last=False)
+    return result
+
+def clear_linestring_cache():
+    """
+    Empty the in-memory cache used by convert_to_linestrings. Caches on disk
+    are left alone.
+    """
+    _linestring_cache.clear()
+
+def intersection_approach_views(
+    graph,
+    setback=20,
+    intersections=None,
+    radius=6371009,
+):
+    """
+    Find where to look at every intersection from. For each intersection node
+    one point is placed on every road leading into it, setback meters back
+    from the node along the road, with the heading facing the node. All of
+    the legs of all of the intersections are computed together.
+
+    Parameters
+    ----------
+    graph : Networkx.MultiDiGraph
+        input graph, with every road in it so that all legs are found
+    setback : int or float
+        how far back from the intersection to place each point, in meters.
+        legs shorter than this get a point at their far end
+    intersections : {roadname: [[road1], [road2]]}
+        the intersections returned by convert_to_linestrings. if specified,
+        only the nodes at these coordinates are used, otherwise every node
+        where three or more roads meet is used
+    radius : radius of the earth (default in meters)
+
+    Returns
+    ----------
+    a list of dicts with the 'location' (lat, lon) and 'heading' of each point,
+    the 'node' it looks at and the 'leg' node it is on the way to
+    """
+    if intersections is not None:
+        wanted = set()
+        for i in intersections:
+            for j in intersections[i]:
+                wanted.update(j)
+        nodes = [n for n, data in graph.nodes(data=True) if (data['y'], data['x']) in wanted]
+    else:
+        nodes = [n for n in graph if len(_neighbors(graph, n)) >= 3]
+    #Lay the vertices of every leg end to end, each leg starting at its intersection
+    lats = []
+    lons = []
+    leg_starts = []
+    legs = []
+    for n in nodes:
+        for m in _neighbors(graph, n):
+            coords = _leg_coords(graph, n, m)
+            leg_starts.append(len(lats))
+            legs.append((n, m))
+            for x, y in coords:
+                lats.append(y)
+                lons.append(x)
+    if len(legs) == 0:
+        return []
+    lats = np.radians(np.array(lats, dtype=float))
+    lons = np.radians(np.array(lons, dtype=float))
+    leg_starts = np.array(leg_starts)
+    leg_ends = np.append(leg_starts[1:], len(lats)) - 1
+    #Segments joining the end of one leg to the start of the next get no length
+    seg_len = _haversine(lats[:-1], lons[:-1], lats[1:], lons[1:], radius)
+    seg_len[leg_ends[:-1]] = 0
+    along = np.concatenate([[0], np.cumsum(seg_len)])
+    leg_len = along[leg_ends] - along[leg_starts]
+    target = along[leg_starts] + np.minimum(setback, leg_len)
+    index = np.searchsorted(along, target, side='left')
+    index = np.clip(index, leg_starts + 1, np.maximum(leg_ends, leg_starts + 1))
+    index = np.minimum(index, len(lats) - 1)
+    span = along[index] - along[index - 1]
+    fraction = np.divide(target - along[index - 1], span, out=np.zeros_like(span), where=span > 0)
+    lat = lats[index - 1] + (lats[index] - lats[index - 1]) * fraction
+    lon = lons[index - 1] + (lons[index] - lons[index - 1]) * fraction
+    heading = _bearing(lat, lon, lats[leg_starts], lons[leg_starts])
+    lat = np.degrees(lat)
+    lon = np.degrees(lon)
+    return [
+        {'location': (float(lat[i]), float(lon[i])), 'heading': float(heading[i]), 'node': legs[i][0], 'leg': legs[i][1]}
+        for i in range(len(legs))
+    ]
+
+def _neighbors(graph, node):
+    """
+    Find every node joined to a node by an edge in either direction.
+    """
+    if graph.is_directed():
+        return set(graph.predecessors(node)) | set(graph.successors(node))
+    return set(graph[node])
+
+def _leg_coords(graph, node, leg):
+    """
+    Get the (x, y) coordinates of the edge between node and leg, starting at node.
+    """
+    data = graph.get_edge_data(node, leg) or graph.get_edge_data(leg, node)
+    data = data[min(data)] if graph.is_multigraph() else data
+    start = (graph.nodes[node]['x'], graph.nodes[node]['y'])
+    if data.get('geometry') is None:
+        return [start, (graph.nodes[leg]['x'], graph.nodes[leg]['y'])]
+    coords = list(data['geometry'].coords)
+    #Undirected edges keep the geometry in whichever direction it was drawn
+    if _squared_distance(coords[-1], start) < _squared_distance(coords[0], start):
+        coords.reverse()
+    return coords
+
+def _squared_distance(a, b):
+    return (a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2
+
+def _haversine(lat1, lon1, lat2, lon2, radius):
+    """
+    Great circle distance between arrays of points given in radians.
+    """
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * radius * np.arcsin(np.sqrt(np.minimum(h, 1)))
+
+def _bearing(lat1, lon1, lat2, lon2):
+    """
+    Compass bearing in degrees from arrays of points to other points, given in radians.
+    """
+    y = np.sin(lon2 - lon1) * np.cos(lat2)
+    x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(lon2 - lon1)
+    return (np.degrees(np.arctan2(y, x)) + 360) % 360
 
 def find_end_nodes(graph):
     """
@@ -99,7 +385,12 @@ def find_end_nodes(graph):
     """
     endNodes = []
     for i in graph:
-        if ox.simplification._is_endpoint(graph, i):
+        if graph.is_directed():
+            if ox.simplification._is_endpoint(graph, i):
+                endNodes.append(i)
+        #Undirected graphs from the generate and truncate methods have no predecessors,
+        #so a node is an endpoint if it self-loops or does not join exactly two edges
+        elif i in graph[i] or len(graph[i]) != 2 or graph.degree(i) != 2:
             endNodes.append(i)
     return endNodes
 
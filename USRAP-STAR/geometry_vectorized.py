@@ -0,0 +1,149 @@
+import numpy as np
+import shapely
+from collections import defaultdict
+from geometry import _bearing
+
+def edge_linestrings(graph):
+    """
+    Get the geometry of every edge in a road graph as one array of LineStrings.
+    Edges without a geometry are built straight from their end nodes, all at
+    once. An edge stored in both directions is taken once, when its geometry
+    is the same either way. Parallel edges with different geometry are all kept.
+
+    Parameters
+    ----------
+    graph : Networkx.MultiDiGraph
+        input graph
+
+    Returns
+    ----------
+    numpy array of shapely LineStrings in (lon, lat)
+    """
+    seen = {}
+    geometries = []
+    missing = []
+    for u, v, data in graph.edges(data=True):
+        if data.get('geometry') is not None:
+            coords = data['geometry']
+        else:
+            coords = ((graph.nodes[u]['x'], graph.nodes[u]['y']), (graph.nodes[v]['x'], graph.nodes[v]['y']))
+        others = seen.setdefault(frozenset((u, v)), [])
+        #Only edges between nodes already seen need their coordinates compared
+        if len(others):
+            points = _edge_points(coords)
+            if any(points in (_edge_points(other), _edge_points(other)[::-1]) for other in others):
+                continue
+        others.append(coords)
+        if data.get('geometry') is not None:
+            geometries.append(coords)
+        else:
+            missing.append(coords)
+    geometries = np.array(geometries, dtype=object)
+    if len(missing):
+        geometries = np.concatenate([geometries, shapely.linestrings(np.array(missing, dtype=float))])
+    return geometries
+
+def _edge_points(coords):
+    if isinstance(coords, tuple):
+        return list(coords)
+    return list(coords.coords)
+
+def merge_road_sections(roads):
+    """
+    Merge the edges of every road into its continuous sections of road. This
+    does the same job as convert_to_linestrings, on whole arrays of geometry.
+
+    Parameters
+    ----------
+    roads : a dictionary with road name as key, and Networkx.MultiDiGraph as value
+
+    Returns
+    ----------
+    a dictionary with road name as key, and a numpy array of shapely LineStrings
+    in (lon, lat), one for each section of road, as value
+    """
+    sections = {}
+    for i in roads:
+        edges = edge_linestrings(roads[i])
+        if len(edges) == 0:
+            continue
+        merged = shapely.line_merge(shapely.multilinestrings(edges))
+        sections[i] = shapely.get_parts(merged)
+    return sections
+
+def sections_to_coords(sections):
+    """
+    Convert merged sections of road into lists of (lat, lon), the format the
+    rest of the pipeline uses.
+
+    Parameters
+    ----------
+    sections : the result of merge_road_sections
+
+    Returns
+    ----------
+    a dictionary with road name as key, and a list of lists of (lat, lon) as value
+    """
+    coords = {}
+    for i in sections:
+        points, index = shapely.get_coordinates(sections[i], return_index=True)
+        splits = np.flatnonzero(np.diff(index)) + 1
+        coords[i] = [list(zip(part[:, 1].tolist(), part[:, 0].tolist())) for part in np.split(points, splits)]
+    return coords
+
+def interpolate_sections(
+    sections,
+    distance=1000,
+    radius=6371009,
+):
+    """
+    Find equidistant points along every section of road, all in one call to
+    shapely. Each section is scaled so its longitude and latitude cover the
+    same distance per degree, so positions along it can be measured in meters.
+
+    Parameters
+    ----------
+    sections : the result of merge_road_sections
+    distance : distance between each point in meters
+    radius : radius of the earth (default in meters)
+
+    Returns
+    --------
+    a dictionary with the road name as key and a list of list of (point, bearing)
+    that is the road segments, like interpolate_roads
+    """
+    names = []
+    lines = []
+    for i in sections:
+        for line in sections[i]:
+            names.append(i)
+            lines.append(line)
+    interpolated = defaultdict(list)
+    if len(lines) == 0:
+        return interpolated
+    points, index = shapely.get_coordinates(np.array(lines, dtype=object), return_index=True)
+    #Scale longitude by the cosine of each section's mean latitude
+    mean_lat = np.bincount(index, weights=points[:, 1]) / np.bincount(index)
+    scale = np.cos(np.radians(mean_lat))
+    meters_per_degree = np.pi / 180 * radius
+    scaled = shapely.linestrings(points[:, 0] * scale[index], points[:, 1], indices=index)
+    lengths = shapely.length(scaled) * meters_per_degree
+    counts = np.floor(lengths / distance).astype(int) + 1
+    owner = np.repeat(np.arange(len(lines)), counts)
+    offsets = (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)) * distance
+    #Look a meter ahead of each point, or back from the end, to find its bearing
+    ahead = np.minimum(offsets + 1, lengths[owner])
+    behind = np.minimum(offsets, ahead - 1)
+    start = shapely.get_coordinates(shapely.line_interpolate_point(scaled[owner], behind / meters_per_degree))
+    end = shapely.get_coordinates(shapely.line_interpolate_point(scaled[owner], ahead / meters_per_degree))
+    at = shapely.get_coordinates(shapely.line_interpolate_point(scaled[owner], offsets / meters_per_degree))
+    lat = at[:, 1]
+    lon = at[:, 0] / scale[owner]
+    bearing = _bearing(
+        np.radians(start[:, 1]), np.radians(start[:, 0] / scale[owner]),
+        np.radians(end[:, 1]), np.radians(end[:, 0] / scale[owner]),
+    )
+    splits = np.cumsum(counts)[:-1]
+    for n, (lat_part, lon_part, bearing_part) in enumerate(zip(np.split(lat, splits), np.split(lon, splits), np.split(bearing, splits))):
+        interpolated[names[n]].append(list(zip(zip(lat_part.tolist(), lon_part.tolist()), bearing_part.tolist())))
+    return interpolated
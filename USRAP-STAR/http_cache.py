@@ -0,0 +1,308 @@
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import requests
+
+#Parameters that identify the caller rather than the request
+SECRET_PARAMS = ('key', 'signature', 'client')
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS responses (
+        request_key TEXT PRIMARY KEY,
+        url TEXT NOT NULL,
+        params TEXT NOT NULL,
+        status INTEGER NOT NULL,
+        content_type TEXT,
+        body BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        created REAL NOT NULL,
+        accessed REAL NOT NULL,
+        reference TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)",
+    "CREATE TABLE IF NOT EXISTS stats (id INTEGER PRIMARY KEY CHECK (id = 0), total_bytes INTEGER NOT NULL)",
+    "INSERT OR IGNORE INTO stats SELECT 0, COALESCE(SUM(size), 0) FROM responses",
+]
+
+def request_key(url, params):
+    """
+    Name a request by its url and normalized parameters. The API key and
+    other credentials are left out, parameter order does not matter, and
+    numbers and 'lat,lon' locations are written with the same precision
+    however they were passed in.
+
+    Parameters
+    ----------
+    url : string
+        the url of the request
+    params : dict
+        the query parameters of the request
+
+    Returns
+    -------
+    hex digest string identifying the request
+    """
+    normalized = sorted(
+        (name, _normalize_value(name, value))
+        for name, value in params.items()
+        if name not in SECRET_PARAMS and value is not None
+    )
+    return hashlib.sha256(json.dumps([url, normalized]).encode()).hexdigest()
+
+def open_cache(cache_path):
+    """
+    Open a response cache, creating it or bringing it up to date if needed.
+    This takes the write lock, so open a cache once and pass the connection
+    to cached_get and cached_reference, or use connect_cache for more
+    connections to a cache that is already open.
+
+    Parameters
+    ----------
+    cache_path : string or pathlib.Path
+        the SQLite file holding the cache
+
+    Returns
+    -------
+    sqlite3.Connection
+    """
+    directory = os.path.dirname(os.path.abspath(cache_path))
+    os.makedirs(directory, exist_ok=True)
+    connection = connect_cache(cache_path)
+    connection.execute('PRAGMA journal_mode=WAL')
+    with _immediate(connection):
+        stats = [row[1] for row in connection.execute('PRAGMA table_info(stats)')]
+        #Caches made by earlier versions kept a stats row per writer that raced to create it
+        if len(stats) and 'id' not in stats:
+            connection.execute('DROP TABLE stats')
+        responses = [row[1] for row in connection.execute('PRAGMA table_info(responses)')]
+        if len(responses) and 'reference' not in responses:
+            connection.execute('ALTER TABLE responses ADD COLUMN reference TEXT')
+        for statement in _SCHEMA:
+            connection.execute(statement)
+    return connection
+
+def connect_cache(cache_path):
+    """
+    Connect to a response cache that open_cache has already created, without
+    checking its tables, such as once for each thread making requests.
+
+    Parameters
+    ----------
+    cache_path : string or pathlib.Path
+        the SQLite file holding the cache
+
+    Returns
+    -------
+    sqlite3.Connection, which may be closed from any thread
+    """
+    #Transactions are begun by hand, so that byte counts are read and written in one
+    return sqlite3.connect(cache_path, timeout=30, isolation_level=None, check_same_thread=False)
+
+def cached_get(
+    url,
+    params,
+    cache,
+    mode='record',
+    ttl=30 * 24 * 60 * 60,
+    max_bytes=10 * 2 ** 30,
+    session=None,
+    timeout=30,
+    is_cacheable=None,
+):
+    """
+    Make a GET request through a persistent cache. Only successful responses
+    are cached.
+
+    Parameters
+    ----------
+    url : string
+        the url to request
+    params : dict
+        the query parameters of the request
+    cache : string, pathlib.Path or sqlite3.Connection
+        the SQLite file holding the cache, or a connection to it from
+        open_cache or connect_cache
+    mode : string {"record", "replay", "refresh"}
+        "record" serves fresh cached responses and fetches and caches the rest,
+        "replay" only serves from the cache, however old, and never touches the
+        network, and "refresh" always fetches and replaces what is cached
+    ttl : int or float
+        seconds a cached response stays fresh in record mode
+    max_bytes : int
+        the most bytes of response bodies to keep, least recently used
+        responses are evicted past this
+    session : requests.Session
+        the session to make the request with
+    timeout : int or float
+        seconds to wait for the server before giving up
+    is_cacheable : function
+        called with the body of a successful response, returning False if it
+        should not be cached, such as an API error sent with status 200
+
+    Returns
+    -------
+    (status, content_type, body) of the response
+    """
+    if mode not in ('record', 'replay', 'refresh'):
+        raise ValueError('mode must be "record", "replay" or "refresh", not %r' % mode)
+    key = request_key(url, params)
+    now = time.time()
+    connection, opened = _connection(cache)
+    try:
+        if mode != 'refresh':
+            row = connection.execute(
+                'SELECT status, content_type, body, created FROM responses WHERE request_key = ? AND reference IS NULL',
+                (key,),
+            ).fetchone()
+            if row is not None and (mode == 'replay' or now - row[3] < ttl):
+                connection.execute('UPDATE responses SET accessed = ? WHERE request_key = ?', (now, key))
+                return row[0], row[1], row[2]
+            if mode == 'replay':
+                raise LookupError('no cached response for %s with %s' % (url, _public_params(params)))
+        response = (session or requests).get(url, params=params, timeout=timeout)
+        body = response.content
+        content_type = response.headers.get('Content-Type')
+        if response.status_code == 200 and (is_cacheable is None or is_cacheable(body)):
+            _store(connection, key, url, params, content_type, body, None, now, max_bytes)
+        return response.status_code, content_type, body
+    finally:
+        if opened:
+            connection.close()
+
+def cached_reference(
+    url,
+    params,
+    cache,
+    fetch,
+    mode='record',
+    ttl=30 * 24 * 60 * 60,
+    is_valid=None,
+):
+    """
+    Make a request through a persistent cache that keeps only a reference to
+    where the response was saved, such as the hash of an image in the image
+    store, so large responses can be streamed to disk and are not stored twice.
+
+    Parameters
+    ----------
+    url : string
+        the url of the request
+    params : dict
+        the query parameters of the request
+    cache : string, pathlib.Path or sqlite3.Connection
+        the SQLite file holding the cache, or a connection to it from
+        open_cache or connect_cache
+    fetch : function
+        called with no arguments to make the request and save the response,
+        returning the reference as a string
+    mode : string {"record", "replay", "refresh"}
+        as in cached_get
+    ttl : int or float
+        seconds a cached reference stays fresh in record mode
+    is_valid : function
+        called with a cached reference, returning False if what it points to
+        is gone and the request has to be made again
+
+    Returns
+    -------
+    the reference
+    """
+    if mode not in ('record', 'replay', 'refresh'):
+        raise ValueError('mode must be "record", "replay" or "refresh", not %r' % mode)
+    key = request_key(url, params)
+    now = time.time()
+    connection, opened = _connection(cache)
+    try:
+        if mode != 'refresh':
+            row = connection.execute(
+                'SELECT reference, created FROM responses WHERE request_key = ? AND reference IS NOT NULL', (key,)
+            ).fetchone()
+            if row is not None and (mode == 'replay' or now - row[1] < ttl) and (is_valid is None or is_valid(row[0])):
+                connection.execute('UPDATE responses SET accessed = ? WHERE request_key = ?', (now, key))
+                return row[0]
+            if mode == 'replay':
+                raise LookupError('no cached response for %s with %s' % (url, _public_params(params)))
+        reference = fetch()
+        _store(connection, key, url, params, None, b'', reference, now)
+        return reference
+    finally:
+        if opened:
+            connection.close()
+
+def _connection(cache):
+    """
+    Get a connection to a cache given as a path or a connection, and whether
+    it was opened here and so should be closed here.
+    """
+    if isinstance(cache, sqlite3.Connection):
+        return cache, False
+    return open_cache(cache), True
+
+@contextlib.contextmanager
+def _immediate(connection):
+    """
+    Run a block in a transaction that holds the write lock from the start.
+    """
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        yield
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+    connection.execute('COMMIT')
+
+def _store(connection, key, url, params, content_type, body, reference, now, max_bytes=None):
+    """
+    Save a response, keeping the byte count of the cache in step with it.
+    """
+    with _immediate(connection):
+        old = connection.execute('SELECT size FROM responses WHERE request_key = ?', (key,)).fetchone()
+        connection.execute('UPDATE stats SET total_bytes = total_bytes + ?', (len(body) - (old[0] if old else 0),))
+        connection.execute(
+            'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (key, url, json.dumps(_public_params(params), sort_keys=True, default=str),
+             200, content_type, body, len(body), now, now, reference),
+        )
+        if max_bytes is not None:
+            _evict(connection, max_bytes)
+
+def _evict(connection, max_bytes):
+    """
+    Delete the least recently used responses until the cache fits in max_bytes.
+    References take no room, so they are never evicted.
+    """
+    total = connection.execute('SELECT total_bytes FROM stats').fetchone()[0]
+    if total <= max_bytes:
+        return
+    doomed = []
+    for key, size in connection.execute('SELECT request_key, size FROM responses WHERE size > 0 ORDER BY accessed'):
+        if total <= max_bytes:
+            break
+        doomed.append((key,))
+        total -= size
+    connection.executemany('DELETE FROM responses WHERE request_key = ?', doomed)
+    connection.execute('UPDATE stats SET total_bytes = ?', (total,))
+
+def _public_params(params):
+    return {name: value for name, value in params.items() if name not in SECRET_PARAMS}
+
+def _normalize_value(name, value):
+    """
+    Write a parameter value the same way no matter how it was passed in.
+    """
+    value = str(value).strip()
+    try:
+        return '%.6f' % float(value)
+    except ValueError:
+        pass
+    if name == 'location':
+        parts = value.split(',')
+        try:
+            return ','.join('%.6f' % float(part) for part in parts)
+        except ValueError:
+            #Addresses and place names are kept as they are, apart from case and spacing
+            return ' '.join(value.lower().split())
+    return value
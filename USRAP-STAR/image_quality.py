@@ -0,0 +1,194 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+import image_store
+
+PLACEHOLDER = 'placeholder'
+NEAR_DUPLICATE = 'near_duplicate'
+UNREADABLE = 'unreadable'
+
+#Grey level of the background of the 'Sorry, we have no imagery here.' image, #e4e3df
+PLACEHOLDER_GREY = 227
+
+def filter_images(
+    store_dir,
+    batch_size=64,
+    max_workers=None,
+    max_distance=6,
+    max_heading_change=30,
+    refilter=False,
+):
+    """
+    Reject the unusable images in an image store before they are scored.
+    Images are decoded and hashed in batches across a pool of processes, then
+    the manifest is walked in order along each road to drop frames that look
+    nearly the same as the frame before them. Why each image was rejected is
+    recorded in the manifest, and rejected images are left out of lookups.
+
+    Images are rejected as 'placeholder' when they are the flat grey image
+    Street View returns where it has no imagery, 'near_duplicate' when they are
+    within max_distance bits of the last kept frame of the same section facing
+    the same way, and 'unreadable' when they cannot be decoded. Indoor
+    panoramas are avoided when fetching, by extract_images asking for outdoor
+    imagery only.
+
+    Decoding is split across processes so that it can use every core, but how
+    the speed scales with cores has only been measured on one core so far, see
+    benchmarks/bench_image_quality.py.
+
+    Parameters
+    ----------
+    store_dir : string or pathlib.Path
+        root directory of the image store
+    batch_size : int
+        how many images each process decodes at a time
+    max_workers : int
+        how many processes to decode with, one per core if not specified
+    max_distance : int
+        the most bits two 64 bit perceptual hashes can differ by for the images
+        to count as near duplicates
+    max_heading_change : int or float
+        frames facing more than this many degrees apart are never duplicates
+    refilter : bool
+        if True, filter images that have been filtered before again
+
+    Returns
+    -------
+    a dictionary with each reason as key and how many images were rejected for it
+    """
+    connection = image_store.open_manifest(store_dir)
+    try:
+        rows = [dict(row) for row in connection.execute(
+            'SELECT id, file_hash, road, section, point_offset, heading, phash, rejected, extension FROM images'
+            ' ORDER BY road, section, point_offset, id'
+        )]
+    finally:
+        connection.close()
+    #Decode each stored file once, however many points share it
+    pending = sorted({
+        (row['file_hash'], row['extension'] or '.jpg') for row in rows if refilter or row['phash'] is None
+    })
+    batches = [
+        [(file_hash, image_store.image_path(store_dir, file_hash, extension))
+         for file_hash, extension in pending[i:i + batch_size]]
+        for i in range(0, len(pending), batch_size)
+    ]
+    analyzed = {}
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        for batch in executor.map(_analyze_batch, batches):
+            analyzed.update(batch)
+
+    results = []
+    counts = {}
+    previous = None
+    for row in rows:
+        if row['file_hash'] in analyzed:
+            phash, rejected = analyzed[row['file_hash']]
+        elif refilter or row['rejected'] != NEAR_DUPLICATE:
+            phash, rejected = row['phash'], row['rejected']
+        else:
+            #Near duplicates are decided again below, against the frames kept this time
+            phash, rejected = row['phash'], None
+        if previous is not None and (previous['road'], previous['section']) != (row['road'], row['section']):
+            previous = None
+        if rejected is None and previous is not None and _is_near_duplicate(
+            previous, row, phash, max_distance, max_heading_change,
+        ):
+            rejected = NEAR_DUPLICATE
+        if rejected is None:
+            previous = dict(row, phash=phash)
+        else:
+            counts[rejected] = counts.get(rejected, 0) + 1
+        results.append((row['id'], phash, rejected))
+    image_store.record_quality(store_dir, results)
+    return counts
+
+def perceptual_hash(image, hash_size=8):
+    """
+    Find the difference hash of an image: shrink it to a grey (hash_size + 1)
+    by hash_size grid and set one bit for every pixel brighter than the pixel
+    to its right. Similar images have hashes that differ in few bits.
+
+    Parameters
+    ----------
+    image : PIL.Image.Image
+        the decoded image
+    hash_size : int
+        the hash has hash_size squared bits
+
+    Returns
+    -------
+    the hash as a hex string
+    """
+    pixels = list(image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR).getdata())
+    bits = 0
+    for row in range(hash_size):
+        for column in range(hash_size):
+            left = pixels[row * (hash_size + 1) + column]
+            right = pixels[row * (hash_size + 1) + column + 1]
+            bits = (bits << 1) | (left > right)
+    return '%0*x' % (hash_size * hash_size // 4, bits)
+
+def is_placeholder(image, max_spread=12, min_share=0.9, level=PLACEHOLDER_GREY):
+    """
+    Check whether an image is the plain grey picture Street View sends back
+    where it has no imagery. Almost all of such an image is one flat light
+    grey, broken only by a line of text. Night, fog and overcast frames can be
+    just as flat, so the background also has to be the placeholder's grey.
+
+    Parameters
+    ----------
+    image : PIL.Image.Image
+        the decoded image
+    max_spread : int
+        how far from the most common grey level a pixel can be and still count
+        as part of the flat background, and how far the most common level can
+        be from level
+    min_share : float
+        the share of pixels that have to be background, from 0 to 1
+    level : int
+        the grey level of the placeholder's background, from 0 to 255
+
+    Returns
+    -------
+    bool
+    """
+    histogram = image.convert('L').resize((64, 64)).histogram()
+    peak = histogram.index(max(histogram))
+    if abs(peak - level) > max_spread:
+        return False
+    background = sum(histogram[max(0, peak - max_spread):peak + max_spread + 1])
+    return background >= min_share * sum(histogram)
+
+def hamming_distance(first, second):
+    """
+    Count the bits two hex hashes differ in.
+    """
+    return bin(int(first, 16) ^ int(second, 16)).count('1')
+
+def _analyze_batch(batch):
+    """
+    Decode and hash a batch of stored images, in a worker process.
+    """
+    analyzed = {}
+    for file_hash, path in batch:
+        try:
+            with Image.open(path) as image:
+                image.draft('RGB', (128, 128))
+                image.load()
+                if is_placeholder(image):
+                    analyzed[file_hash] = (perceptual_hash(image), PLACEHOLDER)
+                else:
+                    analyzed[file_hash] = (perceptual_hash(image), None)
+        except (OSError, SyntaxError):
+            analyzed[file_hash] = (None, UNREADABLE)
+    return analyzed
+
+def _is_near_duplicate(previous, row, phash, max_distance, max_heading_change):
+    if previous['phash'] is None or phash is None:
+        return False
+    if previous['heading'] is not None and row['heading'] is not None:
+        turn = abs(previous['heading'] - row['heading']) % 360
+        if min(turn, 360 - turn) > max_heading_change:
+            return False
+    return hamming_distance(previous['phash'], phash) <= max_distance
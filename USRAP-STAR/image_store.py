@@ -0,0 +1,288 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+
+MANIFEST_NAME = 'manifest.sqlite'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    file_hash TEXT NOT NULL,
+    road TEXT,
+    section INTEGER,
+    point_offset REAL,
+    lat REAL,
+    lon REAL,
+    heading REAL,
+    pano_id TEXT,
+    phash TEXT,
+    rejected TEXT,
+    extension TEXT
+);
+CREATE INDEX IF NOT EXISTS images_road ON images (road, section, point_offset);
+CREATE INDEX IF NOT EXISTS images_lat_lon ON images (lat, lon);
+CREATE INDEX IF NOT EXISTS images_hash ON images (file_hash);
+CREATE INDEX IF NOT EXISTS images_pano ON images (pano_id);
+"""
+
+#SQLite treats NULLs as distinct in unique constraints, so missing labels are compared as sentinels
+_POINT_INDEX = """
+CREATE UNIQUE INDEX IF NOT EXISTS images_point ON images (
+    file_hash, COALESCE(road, ''), COALESCE(section, -1), COALESCE(point_offset, -1), COALESCE(heading, -1)
+)
+"""
+
+_COLUMNS = ('file_hash', 'road', 'section', 'point_offset', 'lat', 'lon', 'heading', 'pano_id', 'extension')
+
+def open_manifest(store_dir):
+    """
+    Open the SQLite manifest of an image store, creating the store if needed.
+
+    Parameters
+    ----------
+    store_dir : string or pathlib.Path
+        root directory of the image store
+
+    Returns
+    -------
+    sqlite3.Connection
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    connection = sqlite3.connect(os.path.join(store_dir, MANIFEST_NAME))
+    connection.row_factory = sqlite3.Row
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.executescript(_SCHEMA)
+    #Manifests made by earlier versions lack some columns
+    columns = [row[1] for row in connection.execute('PRAGMA table_info(images)')]
+    for column in ('phash', 'rejected', 'extension'):
+        if column not in columns:
+            connection.execute('ALTER TABLE images ADD COLUMN %s TEXT' % column)
+    if connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'images_point'").fetchone() is None:
+        with connection:
+            #Earlier versions let unlabelled points be indexed more than once
+            connection.execute(
+                "DELETE FROM images WHERE id NOT IN (SELECT MIN(id) FROM images GROUP BY file_hash,"
+                " COALESCE(road, ''), COALESCE(section, -1), COALESCE(point_offset, -1), COALESCE(heading, -1))"
+            )
+            connection.execute(_POINT_INDEX)
+    return connection
+
+def image_path(store_dir, file_hash, extension='.jpg'):
+    """
+    Find where an image with a given content hash lives in the store. Images
+    are sharded into two levels of directories by the leading characters of
+    the hash so that no directory grows past a few thousand entries.
+
+    Parameters
+    ----------
+    store_dir : string or pathlib.Path
+        root directory of the image store
+    file_hash : string
+        hex sha256 digest of the image contents
+    extension : string
+        file extension of the stored image
+
+    Returns
+    -------
+    string path of the image
+    """
+    return os.path.join(store_dir, file_hash[:2], file_hash[2:4], file_hash + extension)
+
+def write_image(store_dir, image, extension='.jpg'):
+    """
+    Atomically write the bytes of an image into its content-addressed location.
+    The bytes are written to a temporary file in the destination directory and
+    renamed into place, so readers never see a partially written image.
+
+    Parameters
+    ----------
+    store_dir : string or pathlib.Path
+        root directory of the image store
+    image : bytes
+        the encoded image
+    extension : string
+        file extension of the stored image
+
+    Returns
+    -------
+    file_hash : string
+        hex sha256 digest of the image contents
+    """
+    file_hash = hashlib.sha256(image).hexdigest()
+    path = image_path(store_dir, file_hash, extension)
+    #Identical contents are already stored under the same name
+    if os.path.exists(path):
+        return file_hash
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(image)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return file_hash
+
+def store_images(store_dir, images, extension='.jpg'):
+    """
+    Write a batch of images into the store and index them in the manifest.
+
+    Parameters
+    ----------
+    store_dir : string or pathlib.Path
+        root directory of the image store
+    images : list of dict
+        each dict holds the encoded 'image' bytes, its 'location' as (lat, lon)
+        and 'heading', and optionally 'road', 'section', 'offset' (distance
+        along the section in meters) and 'pano_id'
+    extension : string
+        file extension of the stored images
+
+    Returns
+    -------
+    a list of the file hashes of the images, in the same order as images
+    """
+    records = []
+    for image in images:
+        record = dict(image)
+        record['file_hash'] = write_image(store_dir, record.pop('image'), extension)
+        record['extension'] = extension
+        records.append(record)
+    add_to_manifest(store_dir, records)
+    return [record['file_hash'] for record in records]
+
+def add_to_manifest(store_dir, records):
+    """
+    Index images that are already in the store in the manifest. Indexing the
+    same image for the same point twice is a no-op.
+
+    Parameters
+    ----------
+    store_dir : string or pathlib.Path
+        root directory of the image store
+    records : list of dict
+        each dict holds the 'file_hash' of a stored image, its 'location' as
+        (lat, lon) and 'heading', and optionally 'road', 'section', 'offset',
+        'pano_id' and the 'extension' it was stored with, '.jpg' if not given
+    """
+    rows = []
+    for record in records:
+        lat, lon = record['location']
+        rows.append((
+            record['file_hash'],
+            record.get('road'),
+            record.get('section'),
+            record.get('offset'),
+            lat,
+            lon,
+            record.get('heading'),
+            record.get('pano_id'),
+            record.get('extension', '.jpg'),
+        ))
+    connection = open_manifest(store_dir)
+    try:
+        with connection:
+            connection.executemany(
+                'INSERT OR IGNORE INTO images (%s) VALUES (%s)'
+                % (', '.join(_COLUMNS), ', '.join('?' * len(_COLUMNS))),
+                rows,
+            )
+    finally:
+        connection.close()
+
+def record_quality(store_dir, results):
+    """
+    Record the perceptual hash of indexed images, and why any were rejected.
+
+    Parameters
+    ----------
+    store_dir : string or pathlib.Path
+        root directory of the image store
+    results : list of tuple
+        (id, phash, rejected) for each manifest row, where rejected is None for
+        images that were kept
+    """
+    connection = open_manifest(store_dir)
+    try:
+        with connection:
+            connection.executemany(
+                'UPDATE images SET phash = ?, rejected = ? WHERE id = ?',
+                [(phash, rejected, row_id) for row_id, phash, rejected in results],
+            )
+    finally:
+        connection.close()
+
+def find_images_by_road(store_dir, road, section=None, include_rejected=False):
+    """
+    Find the images of a road, or of one section of a road, ordered by their
+    position along the road.
+
+    Parameters
+    ----------
+    store_dir : string or pathlib.Path
+        root directory of the image store
+    road : string
+        the road name the images were indexed under
+    section : int
+        only return images from this section of the road if specified
+    include_rejected : bool
+        if True, also return images rejected by image quality filtering
+
+    Returns
+    -------
+    a list of dicts with the manifest columns of each image and its 'path'
+    """
+    query = 'SELECT * FROM images WHERE road = ?'
+    args = [road]
+    if section is not None:
+        query += ' AND section = ?'
+        args.append(section)
+    if not include_rejected:
+        query += ' AND rejected IS NULL'
+    query += ' ORDER BY section, point_offset'
+    return _find_images(store_dir, query, args)
+
+def find_images_in_bbox(store_dir, north, south, east, west, include_rejected=False):
+    """
+    Find the images taken inside a bounding box.
+
+    Parameters
+    ----------
+    store_dir : string or pathlib.Path
+        root directory of the image store
+    north : float
+        northern latitude of bounding box
+    south : float
+        southern latitude of bounding box
+    east : float
+        eastern longitude of bounding box
+    west : float
+        western longitude of bounding box
+    include_rejected : bool
+        if True, also return images rejected by image quality filtering
+
+    Returns
+    -------
+    a list of dicts with the manifest columns of each image and its 'path'
+    """
+    query = 'SELECT * FROM images WHERE lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?'
+    if not include_rejected:
+        query += ' AND rejected IS NULL'
+    return _find_images(store_dir, query, [south, north, west, east])
+
+def _find_images(store_dir, query, args):
+    """
+    Run a query against the manifest and attach the path of every image found.
+    """
+    connection = open_manifest(store_dir)
+    try:
+        rows = [dict(row) for row in connection.execute(query, args)]
+    finally:
+        connection.close()
+    for row in rows:
+        row['path'] = image_path(store_dir, row['file_hash'], row['extension'] or '.jpg')
+    return rows
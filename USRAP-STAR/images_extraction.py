@@ -1,47 +1,350 @@
 import requests
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import image_store
+import http_cache
+
+META_BASE = 'https://maps.googleapis.com/maps/api/streetview/metadata?'
+PIC_BASE = 'https://maps.googleapis.com/maps/api/streetview?'
+
+_sessions = threading.local()
 
 def extract_images(
     image_data,
     api_key,
+    store_dir,
     fov=90,
     pitch=0,
-    size="640x640"
+    size="640x640",
+    max_workers=8,
+    retries=2,
+    cache_path=None,
+    cache_mode='record',
+    source='outdoor',
 ):
     """
     Find Google Street View images from the set of points returned from either
-    an extract intersections method or an interpolate roads method.
+    an extract intersections method or an interpolate roads method, and save
+    them into an image store.
 
     Parameters
     -------
-    image_data : dict
+    image_data : list of dict
         the input points. this method requires for there to be 'location' and 'heading'
-        in the dictionary for it to work
+        in the dictionary for it to work, with 'location' as (lat, lon) or a
+        'lat,lon' string. 'road', 'section', 'offset' and 'pano_id' are recorded
+        in the image manifest if present
     api_key : string
         the key that allows for the interaction with the Google API
+    store_dir : string or pathlib.Path
+        root directory of the image store the images are saved into
     fov : int or float
         field of view
     pitch : int or float
         the vertical angle of the image
     size : string
         size of the image in the format of length x width in the format of a string
+    max_workers : int
+        the most images to download at the same time
+    retries : int
+        how many more times to try a download that failed, resuming it where
+        it stopped
+    cache_path : string or pathlib.Path
+        if specified, requests go through the response cache in this file,
+        which records the hash of each image rather than the image itself,
+        see http_cache.cached_reference
+    cache_mode : string {"record", "replay", "refresh"}
+        how to use the response cache, "replay" runs entirely offline
+    source : string {"outdoor", "default"}
+        "outdoor" leaves out indoor panoramas such as the insides of businesses
+
+    Returns
+    -------
+    a list of the points, each with the 'file_hash' of its image, or the 'error'
+    that kept it from downloading. only the downloaded points are indexed in the
+    image store
     """
-    meta_base = 'https://maps.googleapis.com/maps/api/streetview/metadata?'
-    pic_base = 'https://maps.googleapis.com/maps/api/streetview?'
+    jobs = []
     for images in image_data:
-        if images.get('location') and images.get('heading'):
-            meta_params = {'key': api_key, 'location': image_data['location']}
+        if images.get('location') is not None and images.get('heading') is not None:
+            #Parsed before anything is downloaded, since the manifest indexes images by lat and lon
+            location = images['location']
+            images = dict(images, location=_parse_location(location))
             pic_params = {'key': api_key,
-                          'location':  images['location'],
+                          'location': _format_location(location),
                           'heading': images['heading'],
                           'fov': fov,
-	                      'pitch': pitch,
-                          'size': size}
+                          'pitch': pitch,
+                          'size': size,
+                          'source': source}
+            jobs.append((images, pic_params))
         else:
             continue
-    return
+    #Points asking for the same image share one download, and so one partial file
+    requests_by_name = {}
+    for images, pic_params in jobs:
+        requests_by_name.setdefault(_request_name(PIC_BASE, pic_params), pic_params)
+    #The cache is brought up to date once, then each download thread reads it through its own connection
+    connections = []
+    cache = threading.local()
+    if cache_path:
+        http_cache.open_cache(cache_path).close()
+    def fetch(pic_params):
+        if cache_path:
+            if not hasattr(cache, 'connection'):
+                cache.connection = http_cache.connect_cache(cache_path)
+                connections.append(cache.connection)
+            #Images are streamed into the store, and the cache only remembers their hash
+            return http_cache.cached_reference(
+                PIC_BASE,
+                pic_params,
+                cache.connection,
+                lambda: download_image(PIC_BASE, pic_params, store_dir),
+                mode=cache_mode,
+                is_valid=lambda file_hash: os.path.exists(image_store.image_path(store_dir, file_hash)),
+            )
+        return download_image(PIC_BASE, pic_params, store_dir)
+    def fetch_with_retries(pic_params):
+        for attempt in range(retries + 1):
+            try:
+                return fetch(pic_params), None
+            except (IOError, LookupError) as e:
+                error = e
+        return None, error
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = dict(zip(requests_by_name, executor.map(fetch_with_retries, requests_by_name.values())))
+    finally:
+        for connection in connections:
+            connection.close()
+    records = []
+    for images, pic_params in jobs:
+        file_hash, error = results[_request_name(PIC_BASE, pic_params)]
+        if error is None:
+            records.append(dict(images, file_hash=file_hash))
+        else:
+            records.append(dict(images, error=str(error)))
+    image_store.add_to_manifest(store_dir, [record for record in records if 'file_hash' in record])
+    return records
 
 def find_image_metadata(
     image_data,
     api_key,
+    cache_path=None,
+    cache_mode='record',
+    source='outdoor',
+):
+    """
+    Look up the Street View panorama nearest to each point. Metadata requests
+    are free, so this can be used to skip points with no imagery before
+    downloading any images.
+
+    Parameters
+    -------
+    image_data : list of dict
+        the input points. this method requires for there to be a 'location' in
+        the dictionary for it to work
+    api_key : string
+        the key that allows for the interaction with the Google API
+    cache_path : string or pathlib.Path
+        if specified, requests go through the response cache in this file,
+        see http_cache.cached_get
+    cache_mode : string {"record", "replay", "refresh"}
+        how to use the response cache, "replay" runs entirely offline
+    source : string {"outdoor", "default"}
+        "outdoor" leaves out indoor panoramas such as the insides of businesses
+
+    Returns
+    -------
+    a list of the points, each with the 'status' of its lookup, and when a
+    panorama was found its 'pano_id', 'pano_location' and 'date'. only 'OK' and
+    'ZERO_RESULTS' lookups are cached, errors such as 'OVER_QUERY_LIMIT' are
+    returned but asked again next time
+
+    Raises
+    ------
+    requests.HTTPError if the server answers with an HTTP error, whether or
+    not the cache is used
+    """
+    cache = http_cache.open_cache(cache_path) if cache_path else None
+    try:
+        results = []
+        for images in image_data:
+            if images.get('location') is None:
+                continue
+            meta_params = {'key': api_key, 'location': _format_location(images['location']), 'source': source}
+            if cache is not None:
+                status, _, body = http_cache.cached_get(
+                    META_BASE,
+                    meta_params,
+                    cache,
+                    mode=cache_mode,
+                    session=_session(),
+                    is_cacheable=_is_cacheable_metadata,
+                )
+            else:
+                response = _session().get(META_BASE, params=meta_params, timeout=30)
+                status, body = response.status_code, response.content
+            if status != 200:
+                raise requests.HTTPError('%d error looking up %s' % (status, meta_params['location']))
+            metadata = json.loads(body)
+            result = dict(images, status=metadata.get('status'))
+            if metadata.get('status') == 'OK':
+                result['pano_id'] = metadata.get('pano_id')
+                result['pano_location'] = (metadata['location']['lat'], metadata['location']['lng'])
+                result['date'] = metadata.get('date')
+            results.append(result)
+        return results
+    finally:
+        if cache is not None:
+            cache.close()
+
+def _is_cacheable_metadata(body):
+    """
+    Whether a metadata response is an answer about the location, rather than
+    an error such as a denied key or a spent quota that the API sends with
+    status 200.
+    """
+    try:
+        return json.loads(body).get('status') in ('OK', 'ZERO_RESULTS')
+    except ValueError:
+        return False
+
+def download_image(
+    url,
+    params,
+    store_dir,
+    chunk_size=64 * 1024,
+    timeout=30,
+    session=None,
 ):
-    return
\ No newline at end of file
+    """
+    Stream an image into the image store without holding it in memory. The
+    response is written in chunks to a partial file and hashed as it arrives,
+    then renamed into its content-addressed location. If an earlier attempt
+    left a partial file behind, the download resumes from where it stopped.
+
+    Parameters
+    -------
+    url : string
+        the url to request
+    params : dict
+        the query parameters of the request
+    store_dir : string or pathlib.Path
+        root directory of the image store
+    chunk_size : int
+        the most bytes of the response held in memory at once
+    timeout : int or float
+        seconds to wait for the server before giving up
+    session : requests.Session
+        the session to make the request with, one per thread if not given
+
+    Returns
+    -------
+    file_hash : string
+        hex sha256 digest of the image contents
+    """
+    if session is None:
+        session = _session()
+    partial_dir = os.path.join(store_dir, 'partial')
+    os.makedirs(partial_dir, exist_ok=True)
+    partial_path = os.path.join(partial_dir, _request_name(url, params) + '.part')
+    digest = hashlib.sha256()
+    headers = {}
+    received = 0
+    #Rehash what a previous attempt already wrote so the digest covers the whole file
+    if os.path.exists(partial_path):
+        with open(partial_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+                received += len(chunk)
+        if received:
+            headers['Range'] = 'bytes=%d-' % received
+    with session.get(url, params=params, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code == 416 and received:
+            #The partial file is not a prefix of what the server has now, so start over once
+            try:
+                os.unlink(partial_path)
+            except FileNotFoundError:
+                pass
+            return download_image(url, params, store_dir, chunk_size, timeout, session)
+        response.raise_for_status()
+        if response.status_code == 206:
+            mode = 'ab'
+            start = received
+        else:
+            mode = 'wb'
+            start = 0
+            digest = hashlib.sha256()
+        expected = response.headers.get('Content-Length')
+        written = 0
+        with open(partial_path, mode) as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+                digest.update(chunk)
+                written += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+    #Leave a short file in place so the next attempt can resume it
+    if expected is not None and written != int(expected):
+        raise IOError('expected %s bytes from %s but received %d' % (expected, url, written))
+    total = _content_range_total(response.headers.get('Content-Range'))
+    if total is not None and start + written != total:
+        raise IOError('expected %d bytes from %s but have %d' % (total, url, start + written))
+    file_hash = digest.hexdigest()
+    path = image_store.image_path(store_dir, file_hash)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(partial_path, path)
+    return file_hash
+
+def _session():
+    """
+    Get the requests.Session of the current thread, since sessions should not
+    be shared between threads.
+    """
+    if not hasattr(_sessions, 'session'):
+        _sessions.session = requests.Session()
+    return _sessions.session
+
+def _request_name(url, params):
+    """
+    Name a request by its url and parameters, leaving out the API key so the
+    name stays the same when the key changes.
+    """
+    items = sorted((k, str(v)) for k, v in params.items() if k != 'key')
+    return hashlib.sha1(repr((url, items)).encode()).hexdigest()
+
+def _content_range_total(content_range):
+    """
+    Read the total size out of a Content-Range header like 'bytes 100-199/200'.
+    """
+    if not content_range or '/' not in content_range:
+        return None
+    total = content_range.rsplit('/', 1)[1]
+    return int(total) if total.isdigit() else None
+
+def _format_location(location):
+    """
+    Format a (lat, lon) location the way the Street View API expects it.
+    """
+    if isinstance(location, str):
+        return location
+    return '%s,%s' % (location[0], location[1])
+
+def _parse_location(location):
+    """
+    Read a location given as (lat, lon) or as a 'lat,lon' string into a
+    (lat, lon) tuple of floats.
+    """
+    if isinstance(location, str):
+        parts = location.split(',')
+        try:
+            if len(parts) == 2:
+                return (float(parts[0]), float(parts[1]))
+        except ValueError:
+            pass
+        raise ValueError('location %r is not a "lat,lon" string' % location)
+    return (float(location[0]), float(location[1]))
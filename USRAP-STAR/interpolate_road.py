@@ -47,6 +47,82 @@ def interpolate_roads(
                 interpolated[i].append(path)
     return interpolated
 
+def build_distance_tables(roads):
+    """
+    Precompute the length and bearing of every segment of every section of
+    road, so that roads can be resampled at any spacing without recomputing
+    great circle distances or bearings.
+
+    Parameters
+    -------
+    roads : dictionary with the road name as the key, and value is a list of list of coordinates that make up the sections of road
+
+    Returns
+    --------
+    a dictionary with the road name as key and a list of tables, one for each section
+    of road in the same order as roads. each table is a list of
+    (start, cumulative distance, segment length, bearing) for every segment of
+    the section, where start is the (lat, lon) the segment starts at and the
+    cumulative distance is how far along the section it starts, in meters
+    """
+    tables = defaultdict(list)
+    for i in roads:
+        for j in roads[i]:
+            for k in j:
+                table = []
+                cumulative = 0
+                for index in range(len(k) - 1):
+                    start, end = k[index], k[index + 1]
+                    length = ox.distance.great_circle_vec(start[0], start[1], end[0], end[1])
+                    bearing = ox.bearing.calculate_bearing(start[0], start[1], end[0], end[1])
+                    table.append((start, cumulative, length, bearing))
+                    cumulative += length
+                tables[i].append(table)
+    return tables
+
+def interpolate_roads_multi(
+    roads,
+    distances,
+    tables=None,
+):
+    """
+    Find equidistant points along every section of road at several spacings at
+    once, walking each section's distance table a single time. Each section is
+    sampled from its start, every distance meters.
+
+    Parameters
+    -------
+    roads : dictionary with the road name as the key, and value is a list of list of coordinates that make up the sections of road
+    distances : list of distances between each point in meters
+    tables : the result of build_distance_tables for roads, built here if not given
+
+    Returns
+    --------
+    a dictionary with each distance as key, and the value is a dictionary with the road
+    name as key and a list of list of (point, bearing) that is the road segments
+    """
+    if tables is None:
+        tables = build_distance_tables(roads)
+    interpolated = {distance: defaultdict(list) for distance in distances}
+    for i in tables:
+        for table in tables[i]:
+            if len(table) == 0:
+                continue
+            paths = {distance: [] for distance in distances}
+            offsets = {distance: 0 for distance in distances}
+            for start, cumulative, length, bearing in table:
+                end = cumulative + length
+                for distance in distances:
+                    #Place every sample of this spacing that falls on the segment
+                    while offsets[distance] < end:
+                        coord = intermediate_point(start[0], start[1], bearing, offsets[distance] - cumulative)
+                        paths[distance].append((coord, bearing))
+                        offsets[distance] += distance
+            for distance in distances:
+                if len(paths[distance]):
+                    interpolated[distance][i].append(paths[distance])
+    return interpolated
+
 def intermediate_point(lat, lon, bearing, distance, radius=6371009):
     """
     Find a point a certain distance away from a given set of coordinates.
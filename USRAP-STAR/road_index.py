@@ -0,0 +1,235 @@
+import bisect
+import re
+from collections import defaultdict, Counter
+from difflib import SequenceMatcher
+
+#Ways of writing a route prefix, longest first so 'state route' wins over 'state'
+_ROUTE_PREFIXES = [
+    ('california state highway', 'sr'),
+    ('california state route', 'sr'),
+    ('state highway', 'sr'),
+    ('state route', 'sr'),
+    ('state hwy', 'sr'),
+    ('us highway', 'us'),
+    ('us route', 'us'),
+    ('us hwy', 'us'),
+    ('highway', 'sr'),
+    ('hwy', 'sr'),
+    ('u s', 'us'),
+    ('interstate', 'i'),
+    ('county road', 'cr'),
+    ('county route', 'cr'),
+    ('cal', 'sr'),
+    ('ca', 'sr'),
+    ('sr', 'sr'),
+    ('us', 'us'),
+    ('i', 'i'),
+    ('cr', 'cr'),
+]
+_ROUTE = re.compile(r'^(%s) ?(\d+[a-z]?)$' % '|'.join(re.escape(p) for p, _ in _ROUTE_PREFIXES))
+_PREFIX_NAMES = dict(_ROUTE_PREFIXES)
+
+_WORDS = {
+    'street': 'st', 'avenue': 'ave', 'road': 'rd', 'highway': 'hwy', 'boulevard': 'blvd',
+    'drive': 'dr', 'lane': 'ln', 'court': 'ct', 'place': 'pl', 'parkway': 'pkwy',
+    'expressway': 'expy', 'freeway': 'fwy', 'terrace': 'ter', 'circle': 'cir',
+    'north': 'n', 'south': 's', 'east': 'e', 'west': 'w', 'saint': 'st', 'mount': 'mt',
+}
+
+def normalize_road_name(name):
+    """
+    Reduce a road name or ref to a canonical form, so that different ways of
+    writing the same road match. Case, punctuation and common abbreviations
+    are ignored, and route numbers like 'CA-116', 'Hwy 116' and 'State Route
+    116' all become 'sr 116'.
+
+    Parameters
+    ----------
+    name : string
+        a road name or ref
+
+    Returns
+    -------
+    the normalized string
+    """
+    name = re.sub(r'[^a-z0-9]+', ' ', name.lower()).strip()
+    route = _ROUTE.match(name)
+    if route:
+        return '%s %s' % (_PREFIX_NAMES[route.group(1)], route.group(2))
+    return ' '.join(_WORDS.get(word, word) for word in name.split())
+
+def build_road_index(graph, fields=('name', 'ref')):
+    """
+    Build a lookup from normalized road names and refs to the edges that carry
+    them. The graph is scanned once; every lookup after that avoids scanning it.
+
+    Parameters
+    ----------
+    graph : Networkx.MultiDiGraph
+        input graph
+    fields : tuple
+        the edge attributes to index
+
+    Returns
+    -------
+    index : dict
+        'edges' maps each normalized name to the set of (u, v, key) edges with it,
+        'names' is the sorted list of normalized names for prefix queries, and
+        'grams' maps each trigram to the names containing it for fuzzy queries
+    """
+    edges = defaultdict(set)
+    #Most edges share a handful of names, so normalize each raw value once
+    normalized = {}
+    for u, v, k, data in graph.edges(keys=True, data=True):
+        for field in fields:
+            values = data.get(field)
+            if values is None:
+                continue
+            if type(values) != list:
+                values = [values]
+            for value in values:
+                #OSM puts several refs in one tag separated by semicolons
+                if value not in normalized:
+                    normalized[value] = [normalize_road_name(part) for part in str(value).split(';')]
+                for key in normalized[value]:
+                    if key:
+                        edges[key].add((u, v, k))
+    grams = defaultdict(set)
+    for key in edges:
+        for gram in _trigrams(key):
+            grams[gram].add(key)
+    return {'edges': dict(edges), 'names': sorted(edges), 'grams': dict(grams)}
+
+def find_road_names(index, query, mode='exact', cutoff=0.8, fuzzy_candidates=10):
+    """
+    Find the normalized names in the index that match a query.
+
+    Parameters
+    ----------
+    index : dict
+        the index from build_road_index
+    query : string
+        the road name or ref to look for
+    mode : string {"exact", "prefix", "fuzzy"}
+        "exact" matches the normalized name, "prefix" matches every name that
+        starts with it, and "fuzzy" matches names with the same numbers in
+        them whose other words are at least cutoff similar to it
+    cutoff : float
+        how similar a name has to be to match in fuzzy mode, from 0 to 1
+    fuzzy_candidates : int
+        how many of the names sharing the most trigrams with the query are
+        compared with it in fuzzy mode
+
+    Returns
+    -------
+    list of the matching normalized names
+    """
+    key = normalize_road_name(query)
+    if mode == 'exact':
+        return [key] if key in index['edges'] else []
+    if mode == 'prefix':
+        names = index['names']
+        start = bisect.bisect_left(names, key)
+        end = bisect.bisect_left(names, key + '￿')
+        return names[start:end]
+    if mode == 'fuzzy':
+        #Route and house numbers have to match exactly, so 'sr 16' is never 'sr 116'
+        numbers, words = _split_numbers(key)
+        grams = _trigrams(key)
+        shared = Counter()
+        for gram in grams:
+            shared.update(index['grams'].get(gram, ()))
+        #Only score the names sharing the most trigrams with the query
+        candidates = [name for name, _ in shared.most_common() if _split_numbers(name)[0] == numbers]
+        scored = []
+        for name in candidates[:fuzzy_candidates]:
+            scored.append((SequenceMatcher(None, words, _split_numbers(name)[1]).ratio(), name))
+        return [name for score, name in sorted(scored, reverse=True) if score >= cutoff]
+    raise ValueError('mode must be "exact", "prefix" or "fuzzy", not %r' % mode)
+
+def find_road_edges(index, query, mode='exact', cutoff=0.8):
+    """
+    Find the edges of every road matching a query.
+
+    Parameters
+    ----------
+    index : dict
+        the index from build_road_index
+    query : string
+        the road name or ref to look for
+    mode : string {"exact", "prefix", "fuzzy"}
+        how to match the query, as in find_road_names
+    cutoff : float
+        how similar a name has to be to match in fuzzy mode, from 0 to 1
+
+    Returns
+    -------
+    set of (u, v, key) edges
+    """
+    edges = set()
+    for name in find_road_names(index, query, mode, cutoff):
+        edges |= index['edges'][name]
+    return edges
+
+def isolate_road(graph, index, query, mode='exact', cutoff=0.8):
+    """
+    Make a graph of only the edges of the roads matching a query, like
+    _isolate_road but without scanning or copying the whole graph.
+
+    Parameters
+    ----------
+    graph : Networkx.MultiDiGraph
+        the graph the index was built from
+    index : dict
+        the index from build_road_index
+    query : string
+        the road name or ref to look for
+    mode : string {"exact", "prefix", "fuzzy"}
+        how to match the query, as in find_road_names
+    cutoff : float
+        how similar a name has to be to match in fuzzy mode, from 0 to 1
+
+    Returns
+    -------
+    graph : Networkx.MultiDiGraph
+    """
+    return graph.edge_subgraph(find_road_edges(index, query, mode, cutoff)).copy()
+
+def isolate_roads(graph, index, road_list, mode='exact', cutoff=0.8):
+    """
+    Isolate several roads at once, in the same format as make_road_list.
+
+    Parameters
+    ----------
+    graph : Networkx.MultiDiGraph
+        the graph the index was built from
+    index : dict
+        the index from build_road_index
+    road_list : list
+        the road names or refs to look for
+    mode : string {"exact", "prefix", "fuzzy"}
+        how to match each road, as in find_road_names
+    cutoff : float
+        how similar a name has to be to match in fuzzy mode, from 0 to 1
+
+    Returns
+    -------
+    dictionary with the key being each road in road_list, and the value is a
+    Networkx graph of all edges matching it
+    """
+    return {road: isolate_road(graph, index, road, mode, cutoff) for road in road_list}
+
+def _trigrams(key):
+    padded = '  %s ' % key
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _split_numbers(key):
+    """
+    Split a normalized name into the words with digits in them, and the rest
+    of the words joined back together.
+    """
+    numbers = []
+    words = []
+    for word in key.split():
+        (numbers if any(c.isdigit() for c in word) else words).append(word)
+    return numbers, ' '.join(words)
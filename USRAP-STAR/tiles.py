@@ -0,0 +1,506 @@
+import json
+import math
+import os
+import socket
+import sys
+import time
+import networkx as nx
+from shapely.geometry import box
+import generate
+import truncate
+import geometry
+import interpolate_road
+
+def tile_of(lat, lon, tile_size=0.1):
+    """
+    Find the tile a point falls in. Tiles are a fixed grid of tile_size degree
+    squares, so every machine assigns a point to the same tile.
+
+    Parameters
+    ----------
+    lat : float
+        latitude of the point
+    lon : float
+        longitude of the point
+    tile_size : float
+        width and height of each tile in degrees
+
+    Returns
+    -------
+    tile : string
+        the tile name, '<row>_<column>'
+    """
+    return '%d_%d' % (math.floor(lat / tile_size), math.floor(lon / tile_size))
+
+def tile_bounds(tile, tile_size=0.1):
+    """
+    Get the bounding box of a tile.
+
+    Parameters
+    ----------
+    tile : string
+        the tile name from tile_of
+    tile_size : float
+        width and height of each tile in degrees
+
+    Returns
+    -------
+    (north, south, east, west) of the tile
+    """
+    row, column = (int(i) for i in tile.split('_'))
+    return (row + 1) * tile_size, row * tile_size, (column + 1) * tile_size, column * tile_size
+
+def make_tiles(north, south, east, west, tile_size=0.1):
+    """
+    List every tile that a bounding box touches, in a fixed order.
+
+    Parameters
+    ----------
+    north : float
+        northern latitude of bounding box
+    south : float
+        southern latitude of bounding box
+    east : float
+        eastern longitude of bounding box
+    west : float
+        western longitude of bounding box
+    tile_size : float
+        width and height of each tile in degrees
+
+    Returns
+    -------
+    list of tile names
+    """
+    rows = range(math.floor(south / tile_size), math.floor(north / tile_size) + 1)
+    columns = range(math.floor(west / tile_size), math.floor(east / tile_size) + 1)
+    return ['%d_%d' % (row, column) for row in rows for column in columns]
+
+def create_work_queue(
+    queue_dir,
+    north,
+    south,
+    east,
+    west,
+    tile_size=0.1,
+    distance=1000,
+    buffer=0.02,
+    osm_path=None,
+    network_type='all_private',
+    road_list=None,
+):
+    """
+    Write one task per tile of a region into a shared directory, for workers
+    on any machine that can see it to claim. Nothing is loaded here; each
+    worker loads and sections the network around its own tile.
+
+    Parameters
+    ----------
+    queue_dir : string or pathlib.Path
+        the shared directory to hold the queue
+    north : float
+        northern latitude of the region
+    south : float
+        southern latitude of the region
+    east : float
+        eastern longitude of the region
+    west : float
+        western longitude of the region
+    tile_size : float
+        width and height of each tile in degrees
+    distance : int or float
+        distance between interpolated points in meters
+    buffer : float
+        how far past its tile, in degrees, a worker loads the network at
+        first. it is doubled for as long as a road starting in the tile runs
+        past what was loaded
+    osm_path : string
+        if specified, the network is read from this .osm XML file instead of
+        being downloaded. every worker reads the whole file, so regions too
+        large for one machine should be downloaded instead
+    network_type : string {"all_private", "all", "bike", "drive", "drive_service", "walk"}
+        what type of street network to download
+    road_list : string
+        a filter to only contain certain roads within the graph
+
+    Returns
+    -------
+    list of the tile names queued
+    """
+    for name in ('tasks', 'leases', 'results'):
+        os.makedirs(os.path.join(queue_dir, name), exist_ok=True)
+    tiles = make_tiles(north, south, east, west, tile_size)
+    for tile in tiles:
+        task = {
+            'tile': tile,
+            'tile_size': tile_size,
+            'distance': distance,
+            'buffer': buffer,
+            'region': [north, south, east, west],
+            'osm_path': osm_path,
+            'network_type': network_type,
+            'road_list': road_list,
+        }
+        _write_json(os.path.join(queue_dir, 'tasks', tile + '.json'), task)
+    return tiles
+
+def claim_tile(queue_dir, worker_id, lease_seconds=600):
+    """
+    Claim the next tile nobody has finished or holds a live lease on.
+
+    Each tile has a directory of numbered lease files, and whoever wrote the
+    highest numbered one holds the tile. A worker claims a tile by creating
+    the next number exclusively, and may only do so when the current holder
+    has not renewed within lease_seconds. Two workers that both find a lease
+    expired race to create the same next number, and only one can.
+
+    Parameters
+    ----------
+    queue_dir : string or pathlib.Path
+        the shared directory holding the queue
+    worker_id : string
+        a name for this worker, unique across machines
+    lease_seconds : int or float
+        how long a lease lasts without being renewed
+
+    Returns
+    -------
+    the task of the claimed tile as a dict, or None if there is nothing left to claim
+    """
+    for name in _task_names(queue_dir):
+        tile = name[:-len('.json')]
+        result_path = os.path.join(queue_dir, 'results', name)
+        if os.path.exists(result_path):
+            continue
+        if not _try_lease(_lease_dir(queue_dir, tile), worker_id, lease_seconds):
+            continue
+        #The previous holder may have finished just before its lease was taken over
+        if os.path.exists(result_path):
+            _release_leases(_lease_dir(queue_dir, tile), worker_id)
+            continue
+        with open(os.path.join(queue_dir, 'tasks', name)) as f:
+            return json.load(f)
+    return None
+
+def renew_lease(queue_dir, tile, worker_id):
+    """
+    Tell other workers this worker is still working on a tile.
+
+    Parameters
+    ----------
+    queue_dir : string or pathlib.Path
+        the shared directory holding the queue
+    tile : string
+        the tile name
+    worker_id : string
+        the name the worker claimed the tile with
+
+    Returns
+    -------
+    True if the worker still holds the tile, False if its lease expired and
+    another worker took the tile over
+    """
+    lease_dir = _lease_dir(queue_dir, tile)
+    number, lease = _newest_lease(lease_dir)
+    if lease is None or lease['worker'] != worker_id:
+        return False
+    _write_json(_lease_path(lease_dir, number), {'worker': worker_id, 'renewed': time.time()})
+    return True
+
+def complete_tile(queue_dir, tile, result, worker_id):
+    """
+    Save the result of a tile and give up this worker's leases on it. Leases
+    held by other workers are left alone.
+    """
+    _write_json(os.path.join(queue_dir, 'results', tile + '.json'), result)
+    _release_leases(_lease_dir(queue_dir, tile), worker_id)
+
+def run_tile(task, on_progress=None):
+    """
+    Load the network around a single tile, split it into sections of road,
+    and interpolate the sections that start inside the tile.
+
+    A section of road is every connected piece of road with one name, so a
+    road is never cut at the edge of a tile. The worker loads its tile plus
+    a buffer, and if a road reaching into the tile runs past the buffer, it
+    doubles the buffer and loads again, until every such road is whole or
+    the buffer covers the region. A section belongs to the tile its first
+    point is in, so each section is kept by exactly one tile.
+
+    Parameters
+    ----------
+    task : dict
+        a task from claim_tile
+    on_progress : function
+        called with no arguments between stages, to renew the lease
+
+    Returns
+    -------
+    a dict with the tile name, and its 'sections' and 'points' as lists of
+    [road, start, value], where start is the node the section starts at and
+    value is the paths of the section as lists of (lat, lon), or the points
+    of the section as lists of (point, bearing)
+    """
+    on_progress = on_progress or (lambda: None)
+    region = tuple(task['region'])
+    tile_north, tile_south, tile_east, tile_west = tile_bounds(task['tile'], task['tile_size'])
+    buffer = task['buffer']
+    source = None
+    while True:
+        bounds = (
+            min(tile_north + buffer, region[0]),
+            max(tile_south - buffer, region[1]),
+            min(tile_east + buffer, region[2]),
+            max(tile_west - buffer, region[3]),
+        )
+        if task['osm_path']:
+            #The file is read once, and cut down again for every buffer
+            if source is None:
+                source = _load_network(task, region)
+            graph = source.copy()
+        else:
+            graph = _load_network(task, bounds)
+        inside = _trim_to_bounds(graph, bounds, region)
+        if task['road_list']:
+            graph = truncate._isolate_road(graph, task['road_list'])
+        on_progress()
+        sections, whole = _tile_sections(graph, inside, task['tile'], task['tile_size'], bounds == region)
+        on_progress()
+        if whole:
+            break
+        buffer *= 2
+    distance = task['distance']
+    points = []
+    for road, start, paths in sections:
+        interpolated = interpolate_road.interpolate_roads_multi({road: [paths]}, [distance])[distance]
+        points.append([road, start, interpolated.get(road, [])])
+    return {'tile': task['tile'], 'sections': sections, 'points': points}
+
+def run_worker(queue_dir, worker_id=None, lease_seconds=600):
+    """
+    Claim and run tiles from the queue until none are left.
+
+    Parameters
+    ----------
+    queue_dir : string or pathlib.Path
+        the shared directory holding the queue
+    worker_id : string
+        a name for this worker, unique across machines. defaults to the host
+        name and process id
+    lease_seconds : int or float
+        how long a lease lasts without being renewed
+
+    Returns
+    -------
+    list of the tile names this worker completed
+    """
+    if worker_id is None:
+        worker_id = '%s-%d' % (socket.gethostname(), os.getpid())
+    done = []
+    while True:
+        task = claim_tile(queue_dir, worker_id, lease_seconds)
+        if task is None:
+            return done
+        #A tile taken over midway is still finished, its result is the same either way
+        result = run_tile(task, on_progress=lambda: renew_lease(queue_dir, task['tile'], worker_id))
+        complete_tile(queue_dir, task['tile'], result, worker_id)
+        done.append(task['tile'])
+
+def merge_results(queue_dir):
+    """
+    Combine the results of every tile, putting the sections of each road in
+    the order of the nodes they start at, so the result does not depend on
+    how the region was tiled or which worker finished first. For a graph
+    whose nodes are in id order, as osmnx builds them, this is the order
+    convert_to_linestrings gives them in.
+
+    Parameters
+    ----------
+    queue_dir : string or pathlib.Path
+        the shared directory holding the queue
+
+    Returns
+    -------
+    sections : {roadname : [[[section1, section2]]]}
+        the sections of every road, as from convert_to_linestrings
+    points : {roadname : [[(point, bearing)]]}
+        the interpolated points of every section of every road, as from
+        interpolate_roads_multi at the distance of the queue
+    missing : list
+        names of the tiles that have no result yet
+    """
+    found_sections = []
+    found_points = []
+    missing = []
+    for name in _task_names(queue_dir):
+        path = os.path.join(queue_dir, 'results', name)
+        if not os.path.exists(path):
+            missing.append(name[:-len('.json')])
+            continue
+        with open(path) as f:
+            result = json.load(f)
+        found_sections.extend(result['sections'])
+        found_points.extend(result['points'])
+    sections = {}
+    for road, start, paths in sorted(found_sections, key=lambda row: row[:2]):
+        sections.setdefault(road, []).append([[tuple(point) for point in path] for path in paths])
+    points = {}
+    for road, start, paths in sorted(found_points, key=lambda row: row[:2]):
+        for path in paths:
+            points.setdefault(road, []).append([(tuple(point), bearing) for point, bearing in path])
+    return sections, points, missing
+
+def _load_network(task, bounds):
+    """
+    Load the network of a task within some bounds, keeping the nodes just
+    past them so that roads leaving the bounds can be seen.
+    """
+    north, south, east, west = bounds
+    if task['osm_path']:
+        graph = generate.generate_graph_from_xml_file(task['osm_path'], retain_all=True)
+        return truncate.truncate_to_polygon(graph, box(west, south, east, north), retain_all=True)
+    return generate.generate_graph_from_bbox(
+        north, south, east, west, network_type=task['network_type'], retain_all=True, truncate_by_edge=True,
+    )
+
+def _trim_to_bounds(graph, bounds, region):
+    """
+    Remove every node of a graph outside the region, and every node outside
+    the bounds that is not one edge away from a node inside them. Node order
+    is kept, so roads are walked the same way as in a run over the region.
+
+    Returns
+    -------
+    the set of nodes inside the bounds
+    """
+    def within(node, limits):
+        data = graph.nodes[node]
+        return limits[1] <= data['y'] <= limits[0] and limits[3] <= data['x'] <= limits[2]
+    graph.remove_nodes_from([node for node in graph if not within(node, region)])
+    inside = set(node for node in graph if within(node, bounds))
+    keep = set(inside)
+    for node in inside:
+        keep.update(graph[node])
+    graph.remove_nodes_from([node for node in graph if node not in keep])
+    return inside
+
+def _tile_sections(graph, inside, tile, tile_size, whole_region):
+    """
+    Split the roads of a graph into sections, and keep the sections that
+    start in a tile.
+
+    Returns
+    -------
+    (sections, whole), where sections is a list of [road, start, paths], and
+    whole is False if a road reaching into the tile runs past the nodes inside
+    the bounds, so could not be sectioned
+    """
+    kept = []
+    whole = True
+    roads = geometry.make_road_list(graph)
+    roadstrings, _ = geometry.convert_to_linestrings(roads)
+    for road in sorted(roadstrings):
+        components = list(nx.connected_components(roads[road]))
+        component_of = {node: n for n, nodes in enumerate(components) for node in nodes}
+        #convert_to_linestrings walks one section from the first end node of each component
+        starts = []
+        started = set()
+        for node in geometry.find_end_nodes(roads[road]):
+            if component_of[node] not in started:
+                started.add(component_of[node])
+                starts.append(node)
+        for start, paths in zip(starts, roadstrings[road]):
+            nodes = components[component_of[start]]
+            if not whole_region and not nodes <= inside:
+                if any(_node_tile(graph, node, tile_size) == tile for node in nodes):
+                    whole = False
+                continue
+            if _node_tile(graph, start, tile_size) == tile:
+                kept.append([road, start, paths])
+    return kept, whole
+
+def _node_tile(graph, node, tile_size):
+    return tile_of(graph.nodes[node]['y'], graph.nodes[node]['x'], tile_size)
+
+def _task_names(queue_dir):
+    """
+    List the task files in the queue in order, skipping any still being written.
+    """
+    return sorted(name for name in os.listdir(os.path.join(queue_dir, 'tasks')) if name.endswith('.json'))
+
+def _lease_dir(queue_dir, tile):
+    return os.path.join(queue_dir, 'leases', tile)
+
+def _lease_path(lease_dir, number):
+    return os.path.join(lease_dir, '%d.json' % number)
+
+def _lease_numbers(lease_dir):
+    try:
+        names = os.listdir(lease_dir)
+    except FileNotFoundError:
+        return []
+    return sorted(int(name[:-len('.json')]) for name in names if name.endswith('.json') and name[:-len('.json')].isdigit())
+
+def _newest_lease(lease_dir):
+    """
+    Find the highest numbered lease of a tile and read it. A lease that was
+    created but not yet written is read as renewed just now.
+
+    Returns
+    -------
+    (number, lease), where number is -1 and lease is None if there is no lease
+    """
+    numbers = _lease_numbers(lease_dir)
+    if len(numbers) == 0:
+        return -1, None
+    try:
+        with open(_lease_path(lease_dir, numbers[-1])) as f:
+            return numbers[-1], json.load(f)
+    except (FileNotFoundError, ValueError):
+        return numbers[-1], {'worker': None, 'renewed': time.time()}
+
+def _try_lease(lease_dir, worker_id, lease_seconds):
+    """
+    Try to take the lease on a tile, taking over from a holder whose lease
+    has expired.
+    """
+    os.makedirs(lease_dir, exist_ok=True)
+    number, lease = _newest_lease(lease_dir)
+    if lease is not None and time.time() - lease['renewed'] < lease_seconds:
+        return False
+    try:
+        fd = os.open(_lease_path(lease_dir, number + 1), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'worker': worker_id, 'renewed': time.time()}, f)
+    return True
+
+def _release_leases(lease_dir, worker_id):
+    """
+    Delete the leases a worker holds or held on a tile, and no others.
+    """
+    for number in _lease_numbers(lease_dir):
+        path = _lease_path(lease_dir, number)
+        try:
+            with open(path) as f:
+                lease = json.load(f)
+        except (FileNotFoundError, ValueError):
+            continue
+        if lease['worker'] == worker_id:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+def _write_json(path, data):
+    """
+    Write json to a path atomically, so a reader never sees half a file.
+    """
+    temp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(temp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+if __name__ == '__main__':
+    #python tiles.py <queue_dir> runs one worker against a queue
+    print(run_worker(sys.argv[1]))
@@ -1,6 +1,7 @@
 import networkx as nx
 import osmnx as ox
 import copy
+from generate import to_undirected
 
 def truncate_to_polygon(
     graph, 
@@ -52,7 +53,7 @@ def truncate_to_polygon(
         quadrat_width=quadrat_width, 
         min_num=min_num,
     )
-    graph = ox.get_undirected(ox.get_digraph(graph))
+    graph = to_undirected(graph)
     #Remove edges that do not have their name in road_list
     if road_list:
         graph = _isolate_road(graph, road_list)
@@ -120,7 +121,7 @@ def truncate_to_bbox(
         quadrat_width=quadrat_width, 
         min_num=min_num,
     )
-    graph = ox.get_undirected(ox.get_digraph(graph))
+    graph = to_undirected(graph)
     #Remove edges that do not have their name in road_list
     if road_list:
         graph = _isolate_road(graph, road_list)
@@ -173,7 +174,7 @@ def truncate_around_node(
         retain_all=retain_all,
         road_list=road_list,
     )
-    graph = ox.get_undirected(ox.get_digraph(graph))
+    graph = to_undirected(graph)
     #Remove edges that do not have their name in road_list
     if road_list:
         graph = _isolate_road(graph, road_list)
@@ -0,0 +1,67 @@
+"""
+Compare the tuple-by-tuple geometry path (convert_to_linestrings followed by
+interpolate_roads) with the shapely array path in geometry_vectorized.
+
+Both paths should find the same sections of road, so each reports the
+number of distinct sections it found, counting a section and its reverse
+as one.
+
+    python benchmarks/bench_geometry.py --edges 1000 10000 --distance 100
+"""
+import argparse
+import time
+from synthetic import synthetic_graph
+import geometry
+import geometry_vectorized
+import interpolate_road
+
+def _isolate(graph, name):
+    edges = [(u, v, k) for u, v, k, data in graph.edges(keys=True, data=True) if data.get('name') == name]
+    return graph.edge_subgraph(edges).copy()
+
+def _distinct_sections(roadstrings):
+    """
+    Count the sections of road, taking a section and its reverse as one.
+    """
+    distinct = set()
+    for road in roadstrings:
+        for paths in roadstrings[road]:
+            for path in paths:
+                distinct.add((road, min(tuple(path), tuple(path[::-1]))))
+    return len(distinct)
+
+def run(n_edges, distance):
+    graph = synthetic_graph(n_edges)
+    names = sorted({data['name'] for _, _, data in graph.edges(data=True)})
+    roads = {name: _isolate(graph, name) for name in names}
+
+    start = time.perf_counter()
+    roadstrings, _ = geometry.convert_to_linestrings(roads)
+    converted = time.perf_counter()
+    loop_points = interpolate_road.interpolate_roads(roadstrings, distance=distance)
+    loop_done = time.perf_counter()
+
+    sections = geometry_vectorized.merge_road_sections(roads)
+    merged = time.perf_counter()
+    array_points = geometry_vectorized.interpolate_sections(sections, distance=distance)
+    array_done = time.perf_counter()
+
+    print('%8d edges | tuples: convert %.3fs interpolate %.3fs (%d sections, %d points) | arrays: merge %.3fs interpolate %.3fs (%d sections, %d points)' % (
+        graph.number_of_edges() // 2,
+        converted - start,
+        loop_done - converted,
+        _distinct_sections(roadstrings),
+        sum(len(path) for paths in loop_points.values() for path in paths),
+        merged - loop_done,
+        array_done - merged,
+        sum(len(sections[i]) for i in sections),
+        sum(len(path) for paths in array_points.values() for path in paths),
+    ))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--edges', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--distance', type=float, default=100)
+    args = parser.parse_args()
+    for n_edges in args.edges:
+        run(n_edges, args.distance)
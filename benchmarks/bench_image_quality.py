@@ -0,0 +1,52 @@
+"""
+Time image quality filtering with different numbers of worker processes, to
+see how decoding and hashing scale with cores.
+
+Each run filters a fresh store of synthetic street-sized JPEGs, so no run
+reuses the hashes of another.
+
+    python benchmarks/bench_image_quality.py --images 2000 --workers 1 2 4 8
+"""
+import argparse
+import io
+import os
+import random
+import tempfile
+import time
+from PIL import Image, ImageDraw
+import image_quality
+import image_store
+
+def _frames(n_images, size):
+    frames = []
+    rng = random.Random(0)
+    for n in range(n_images):
+        image = Image.new('RGB', (size, size))
+        draw = ImageDraw.Draw(image)
+        for _ in range(40):
+            x, y = rng.randrange(size), rng.randrange(size)
+            draw.rectangle((x, y, x + size // 8, y + size // 8), fill=tuple(rng.randrange(256) for _ in range(3)))
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=85)
+        frames.append({'image': buffer.getvalue(), 'location': (38.0, -122.0 + n * 1e-5), 'heading': rng.randrange(360),
+                       'road': 'road %d' % (n % 20), 'section': 0, 'offset': n})
+    return frames
+
+def run(frames, workers, batch_size):
+    with tempfile.TemporaryDirectory() as store_dir:
+        image_store.store_images(store_dir, frames)
+        start = time.perf_counter()
+        image_quality.filter_images(store_dir, batch_size=batch_size, max_workers=workers)
+        elapsed = time.perf_counter() - start
+    print('%3d workers | %6d images in %.2fs | %.0f images/s' % (workers, len(frames), elapsed, len(frames) / elapsed))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--images', type=int, default=2000)
+    parser.add_argument('--size', type=int, default=640)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--workers', type=int, nargs='+', default=sorted({1, 2, 4, os.cpu_count()}))
+    args = parser.parse_args()
+    frames = _frames(args.images, args.size)
+    for workers in args.workers:
+        run(frames, workers, args.batch_size)
@@ -0,0 +1,52 @@
+"""
+Compare converting a graph to undirected with osmnx's get_digraph followed by
+get_undirected against the single pass in generate.to_undirected.
+
+    python benchmarks/bench_undirected.py --edges 10000 100000
+"""
+import argparse
+import time
+import tracemalloc
+import networkx as nx
+import osmnx as ox
+from synthetic import synthetic_graph
+import generate
+
+def _two_pass(graph):
+    #get_digraph returns a DiGraph, which get_undirected can only take as a MultiDiGraph
+    return ox.get_undirected(nx.MultiDiGraph(ox.get_digraph(graph)))
+
+def _measure(convert, graph):
+    start = time.perf_counter()
+    undirected = convert(graph)
+    elapsed = time.perf_counter() - start
+    del undirected
+    #Tracing slows everything down, so memory is measured on a second run
+    tracemalloc.start()
+    undirected = convert(graph)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return undirected, elapsed, peak
+
+def run(n_edges):
+    graph = synthetic_graph(n_edges)
+    two_pass, two_pass_time, two_pass_peak = _measure(_two_pass, graph)
+    del two_pass
+    fused, fused_time, fused_peak = _measure(generate.to_undirected, graph)
+    print('%8d edges | two pass: %.3fs peak %.1f MB | fused: %.3fs peak %.1f MB (%d edges) | %.1fx faster, %.1fx less memory' % (
+        graph.number_of_edges() // 2,
+        two_pass_time,
+        two_pass_peak / 2 ** 20,
+        fused_time,
+        fused_peak / 2 ** 20,
+        fused.number_of_edges(),
+        two_pass_time / fused_time,
+        two_pass_peak / fused_peak,
+    ))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--edges', type=int, nargs='+', default=[1000, 10000, 100000])
+    args = parser.parse_args()
+    for n_edges in args.edges:
+        run(n_edges)
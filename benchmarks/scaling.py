@@ -0,0 +1,291 @@
+"""
+Scaling regression harness for the graph pipeline.
+
+Synthesizes street grids of increasing size, writes them out as .osm XML and
+runs generate -> truncate -> make_road_list -> convert_to_linestrings ->
+interpolate_roads on them offline. Each stage runs in its own process so its
+wall time and peak RSS can be measured on their own. The growth of both with
+the number of edges is fit as a power law, and the run fails if a stage is
+slower or larger than its stored budget, grows faster than it used to, or
+grows faster than COMPLEXITY_CEILINGS says it ever should.
+
+    python benchmarks/scaling.py --record          # store budgets from this machine
+    python benchmarks/scaling.py                   # check against stored budgets
+    python benchmarks/scaling.py --large           # also run 1M edges
+    python benchmarks/scaling.py --allow truncate=1.5
+
+The default sizes finish in a few minutes. At 1M edges generate needs about
+10 GB of memory, so that size is left to --large. The committed
+scaling_budgets.json was recorded on a single development machine; record
+new budgets with --record when moving the check to other hardware. The
+complexity ceilings hold on any machine.
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import pickle
+import resource
+import sys
+import tempfile
+import threading
+import time
+from synthetic import synthetic_graph, write_osm_xml
+
+DEFAULT_SIZES = [2000, 5000, 20000, 50000, 100000]
+LARGE_SIZES = [1000000]
+
+BUDGETS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scaling_budgets.json')
+
+STAGES = ['generate', 'truncate', 'make_road_list', 'convert_to_linestrings', 'interpolate_roads']
+
+#The fastest any stage's time or memory may grow with the number of edges, whatever
+#the stored budgets say. Every stage should be about linear; a stage that copies the
+#graph once per road or per tile shows up as n^1.5 or more
+COMPLEXITY_CEILINGS = {stage: 1.25 for stage in STAGES}
+
+def run_stage(stage, data):
+    """
+    Run one stage of the pipeline on the output of the stage before it.
+    """
+    if stage == 'generate':
+        return generate.generate_graph_from_xml_file(data['osm_path'], retain_all=True)
+    if stage == 'truncate':
+        xs = [d['x'] for _, d in data.nodes(data=True)]
+        ys = [d['y'] for _, d in data.nodes(data=True)]
+        return truncate.truncate_to_polygon(data, box(min(xs), min(ys), max(xs), max(ys)), retain_all=True)
+    if stage == 'make_road_list':
+        return geometry.make_road_list(data)
+    if stage == 'convert_to_linestrings':
+        return geometry.convert_to_linestrings(data)[0]
+    if stage == 'interpolate_roads':
+        return interpolate_road.interpolate_roads(data, distance=100)
+    raise ValueError('unknown stage %r' % stage)
+
+def _import_pipeline():
+    """
+    Import the pipeline modules into this module, so stage timings leave out
+    the cost of importing osmnx.
+    """
+    global generate, truncate, geometry, interpolate_road, box
+    import generate
+    import truncate
+    import geometry
+    import interpolate_road
+    from shapely.geometry import box
+
+def _rss():
+    """
+    Current resident set size of this process in bytes.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        #ru_maxrss is in kilobytes on Linux and bytes on macOS
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+def _stage_worker(stage, input_path, output_path, queue):
+    """
+    Load a stage's input, run it while sampling RSS, save its output and report
+    the wall time and the peak RSS above what the input and the pipeline
+    modules took to load.
+    """
+    try:
+        _import_pipeline()
+        with open(input_path, 'rb') as f:
+            data = pickle.load(f)
+        baseline = _rss()
+        peak = [baseline]
+        done = threading.Event()
+        def sample():
+            while not done.wait(0.01):
+                peak[0] = max(peak[0], _rss())
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        start = time.perf_counter()
+        result = run_stage(stage, data)
+        seconds = time.perf_counter() - start
+        done.set()
+        sampler.join()
+        peak[0] = max(peak[0], _rss())
+        with open(output_path, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        queue.put({'seconds': seconds, 'peak_mb': (peak[0] - baseline) / 2 ** 20})
+    except BaseException as e:
+        queue.put({'error': '%s: %s' % (type(e).__name__, e)})
+
+def measure(n_edges, workdir, timeout):
+    """
+    Run the whole pipeline on a grid of about n_edges edges.
+
+    Returns
+    -------
+    a dictionary with stage name as key, and a dictionary of 'seconds' and
+    'peak_mb', or of 'error', as value. stages after a failed one are left out
+    """
+    graph = synthetic_graph(n_edges)
+    osm_path = os.path.join(workdir, 'grid_%d.osm' % n_edges)
+    write_osm_xml(graph, osm_path)
+    input_path = os.path.join(workdir, 'input_%d.pkl' % n_edges)
+    with open(input_path, 'wb') as f:
+        pickle.dump({'osm_path': osm_path}, f)
+    del graph
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for stage in STAGES:
+        output_path = os.path.join(workdir, '%s_%d.pkl' % (stage, n_edges))
+        queue = context.Queue()
+        process = context.Process(target=_stage_worker, args=(stage, input_path, output_path, queue))
+        process.start()
+        process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+            results[stage] = {'error': 'timed out after %ds' % timeout}
+            break
+        results[stage] = queue.get() if not queue.empty() else {'error': 'exited with code %s' % process.exitcode}
+        if 'error' in results[stage]:
+            break
+        os.unlink(input_path)
+        input_path = output_path
+    return results
+
+def fit_exponent(sizes, values):
+    """
+    Fit values = c * sizes ** k by least squares on a log-log scale and return k.
+    """
+    points = [(math.log(s), math.log(max(v, 1e-6))) for s, v in zip(sizes, values)]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    if spread == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+
+def summarize(measurements):
+    """
+    Collect the measurements of every size into per stage curves and fit them.
+    """
+    summary = {}
+    for stage in STAGES:
+        sizes = [n for n in sorted(measurements) if 'seconds' in measurements[n].get(stage, {})]
+        if not sizes:
+            continue
+        seconds = [measurements[n][stage]['seconds'] for n in sizes]
+        peak_mb = [measurements[n][stage]['peak_mb'] for n in sizes]
+        summary[stage] = {
+            'seconds': {str(n): s for n, s in zip(sizes, seconds)},
+            'peak_mb': {str(n): m for n, m in zip(sizes, peak_mb)},
+            #Timings under 10 ms and memory under 1 MB are mostly noise, so fit from there up
+            'time_exponent': fit_exponent(sizes, [max(t, 0.01) for t in seconds]),
+            'memory_exponent': fit_exponent(sizes, [max(m, 1) for m in peak_mb]),
+        }
+    return summary
+
+def check(summary, measurements, budgets, slack, exponent_slack, ceilings=COMPLEXITY_CEILINGS):
+    """
+    Compare a run against the stored budgets and the complexity ceilings.
+
+    Returns
+    -------
+    a list of strings describing every budget that was broken
+    """
+    failures = []
+    for n in sorted(measurements):
+        for stage, result in measurements[n].items():
+            if 'error' in result:
+                failures.append('%s at %d edges failed: %s' % (stage, n, result['error']))
+    for stage, budget in budgets.items():
+        if stage not in summary:
+            continue
+        for n, limit in budget['seconds'].items():
+            took = summary[stage]['seconds'].get(n)
+            #Stages that took under a quarter second vary too much run to run to hold to a time budget
+            if took is not None and took > max(limit * slack, 0.25):
+                failures.append('%s at %s edges took %.2fs, budget %.2fs' % (stage, n, took, limit * slack))
+        for n, limit in budget['peak_mb'].items():
+            used = summary[stage]['peak_mb'].get(n)
+            #Stages that used under 16 MB are not held to a memory budget
+            if used is not None and used > max(limit * slack, 16):
+                failures.append('%s at %s edges peaked at %.1f MB, budget %.1f MB' % (stage, n, used, limit * slack))
+        for key in ('time_exponent', 'memory_exponent'):
+            found, stored = summary[stage][key], budget.get(key)
+            if found is not None and stored is not None and found > stored + exponent_slack:
+                failures.append('%s %s grew from %.2f to %.2f' % (stage, key, stored, found))
+    for stage in summary:
+        for key in ('time_exponent', 'memory_exponent'):
+            found = summary[stage][key]
+            if found is not None and stage in ceilings and found > ceilings[stage]:
+                failures.append('%s %s is %.2f, above its ceiling of %.2f' % (stage, key, found, ceilings[stage]))
+    return failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--large', action='store_true', help='also run %s edges' % ' and '.join(map(str, LARGE_SIZES)))
+    parser.add_argument('--budgets', default=BUDGETS_PATH)
+    parser.add_argument('--record', action='store_true', help='store this run as the new budgets')
+    parser.add_argument('--slack', type=float, default=2.0, help='allowed ratio over a time or memory budget')
+    parser.add_argument('--exponent-slack', type=float, default=0.3, help='allowed growth of a fitted exponent')
+    parser.add_argument('--timeout', type=int, default=3600, help='seconds before a stage is given up on')
+    parser.add_argument(
+        '--allow', action='append', default=[], metavar='STAGE=EXPONENT',
+        help='let a stage grow faster than its complexity ceiling',
+    )
+    args = parser.parse_args(argv)
+    ceilings = dict(COMPLEXITY_CEILINGS)
+    for allowed in args.allow:
+        stage, exponent = allowed.split('=')
+        if stage not in ceilings:
+            parser.error('unknown stage %r' % stage)
+        ceilings[stage] = float(exponent)
+    sizes = args.sizes + LARGE_SIZES if args.large else args.sizes
+
+    measurements = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for n_edges in sizes:
+            measurements[n_edges] = measure(n_edges, workdir, args.timeout)
+            for stage, result in measurements[n_edges].items():
+                if 'error' in result:
+                    print('%8d edges %-24s %s' % (n_edges, stage, result['error']))
+                else:
+                    print('%8d edges %-24s %9.3fs %9.1f MB' % (n_edges, stage, result['seconds'], result['peak_mb']))
+    summary = summarize(measurements)
+    for stage in summary:
+        print('%-24s time ~ n^%s, memory ~ n^%s' % (
+            stage,
+            _format_exponent(summary[stage]['time_exponent']),
+            _format_exponent(summary[stage]['memory_exponent']),
+        ))
+
+    if args.record:
+        #A run that breaks a ceiling should be fixed or allowed, not stored as the baseline
+        failures = check(summary, measurements, {}, args.slack, args.exponent_slack, ceilings)
+        if failures:
+            for failure in failures:
+                print('FAIL', failure)
+            return 1
+        with open(args.budgets, 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+        print('budgets written to %s' % args.budgets)
+        return 0
+    if not os.path.exists(args.budgets):
+        print('FAIL no budgets at %s, run with --record to store some' % args.budgets)
+        return 1
+    with open(args.budgets) as f:
+        budgets = json.load(f)
+    failures = check(summary, measurements, budgets, args.slack, args.exponent_slack, ceilings)
+    for failure in failures:
+        print('FAIL', failure)
+    return 1 if failures else 0
+
+def _format_exponent(exponent):
+    return 'n/a' if exponent is None else '%.2f' % exponent
+
+if __name__ == '__main__':
+    sys.exit(main())
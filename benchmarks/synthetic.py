@@ -0,0 +1,100 @@
+import math
+import os
+import sys
+import networkx as nx
+from shapely.geometry import LineString
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'USRAP-STAR'))
+
+def grid_shape(n_edges):
+    """
+    Find the side of a square street grid with about n_edges undirected edges.
+    """
+    return max(2, int(math.sqrt(n_edges / 2)) + 1)
+
+def synthetic_graph(
+    n_edges,
+    north=38.5,
+    west=-122.9,
+    spacing=0.001,
+):
+    """
+    Build an osmnx-style street grid without touching the network. Every row is
+    a named road and every column a named avenue, each block is an edge stored
+    in both directions with a bent geometry, and nodes carry x and y.
+
+    Parameters
+    ----------
+    n_edges : int
+        about how many undirected edges the grid should have
+    north : float
+        latitude of the top row of the grid
+    west : float
+        longitude of the left column of the grid
+    spacing : float
+        degrees between neighbouring nodes
+
+    Returns
+    -------
+    graph : networkx.MultiDiGraph
+    """
+    side = grid_shape(n_edges)
+    graph = nx.MultiDiGraph(crs='epsg:4326')
+    for r in range(side):
+        for c in range(side):
+            graph.add_node(r * side + c, x=west + c * spacing, y=north - r * spacing, street_count=4)
+    osmid = 0
+    for r in range(side):
+        for c in range(side):
+            node = r * side + c
+            if c + 1 < side:
+                osmid += 1
+                _add_block(graph, node, node + 1, osmid, 'Row %d Road' % r)
+            if r + 1 < side:
+                osmid += 1
+                _add_block(graph, node, node + side, osmid, 'Column %d Avenue' % c)
+    return graph
+
+def _add_block(graph, u, v, osmid, name):
+    """
+    Add one block of road in both directions, bent slightly at its middle.
+    """
+    x1, y1 = graph.nodes[u]['x'], graph.nodes[u]['y']
+    x2, y2 = graph.nodes[v]['x'], graph.nodes[v]['y']
+    middle = ((x1 + x2) / 2 + (y2 - y1) * 0.1, (y1 + y2) / 2 + (x2 - x1) * 0.1)
+    geometry = LineString([(x1, y1), middle, (x2, y2)])
+    length = geometry.length * 111195
+    graph.add_edge(u, v, osmid=osmid, name=name, highway='residential', oneway=False, length=length, geometry=geometry)
+    reverse = LineString(geometry.coords[::-1])
+    graph.add_edge(v, u, osmid=osmid, name=name, highway='residential', oneway=False, length=length, geometry=reverse)
+
+def write_osm_xml(graph, filepath):
+    """
+    Write a synthetic grid out as a .osm XML file, so it can be read back
+    through generate_graph_from_xml_file like a real extract. The bend in
+    every block becomes its own OSM node, which simplification removes again.
+
+    Parameters
+    ----------
+    graph : networkx.MultiDiGraph
+        a graph made by synthetic_graph
+    filepath : string or pathlib.Path
+        where to write the file
+    """
+    next_node = max(graph.nodes) + 1
+    with open(filepath, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6" generator="usrap-synthetic">\n')
+        for node, data in graph.nodes(data=True):
+            f.write('<node id="%d" lat="%.7f" lon="%.7f"/>\n' % (node, data['y'], data['x']))
+        ways = []
+        for u, v, data in graph.edges(data=True):
+            if u > v:
+                continue
+            x, y = data['geometry'].coords[1]
+            f.write('<node id="%d" lat="%.7f" lon="%.7f"/>\n' % (next_node, y, x))
+            ways.append((data['osmid'], u, next_node, v, data['name']))
+            next_node += 1
+        for osmid, u, middle, v, name in ways:
+            f.write('<way id="%d"><nd ref="%d"/><nd ref="%d"/><nd ref="%d"/>'
+                    '<tag k="highway" v="residential"/><tag k="name" v="%s"/></way>\n' % (osmid, u, middle, v, name))
+        f.write('</osm>\n')
@@ -0,0 +1,7 @@
+import os
+import sys
+
+#The pipeline modules are flat files rather than a package
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'USRAP-STAR'))
+sys.path.insert(0, os.path.join(here, '..', 'benchmarks'))
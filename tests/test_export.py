@@ -0,0 +1,36 @@
+import pytest
+import export
+
+ROADSTRINGS = {
+    'Main St': [[[(38.00, -122.00), (38.00, -122.01)], [(38.00, -122.01), (38.01, -122.02)]],
+                [[(38.50, -122.50), (38.51, -122.50)]]],
+    'Oak Ave': [[[(38.00, -122.01), (38.02, -122.01)]]],
+}
+INTERSECTIONS = {
+    'Main St': [[(38.00, -122.00), (38.00, -122.01)], [(38.50, -122.50)]],
+    'Oak Ave': [[(38.00, -122.01)]],
+}
+
+def _rows(frame):
+    return sorted(
+        (row.road, row.group, row.index, [(round(lat, 6), round(lon, 6)) for lon, lat in row.geometry.coords])
+        for row in frame.itertuples()
+    )
+
+@pytest.mark.parametrize('name', ['roads.gpkg', 'roads.parquet'])
+def test_export_round_trip(tmp_path, name):
+    filepath = str(tmp_path / name)
+    export.export_road_sections(ROADSTRINGS, INTERSECTIONS, filepath, batch_size=2)
+    sections = export.read_road_sections(filepath)
+    assert _rows(sections) == sorted(
+        (road, group, index, section)
+        for road in ROADSTRINGS for group, paths in enumerate(ROADSTRINGS[road]) for index, section in enumerate(paths)
+    )
+    intersections = export.read_road_sections(filepath, layer=export.INTERSECTIONS_LAYER)
+    assert _rows(intersections) == sorted(
+        (road, group, index, [point])
+        for road in INTERSECTIONS for group, points in enumerate(INTERSECTIONS[road]) for index, point in enumerate(points)
+    )
+    #Only the second Main St sits inside this box
+    nearby = export.read_road_sections(filepath, north=38.6, south=38.4, east=-122.4, west=-122.6)
+    assert _rows(nearby) == [('Main St', 1, 0, ROADSTRINGS['Main St'][1][0])]
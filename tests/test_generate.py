@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import pytest
+import generate
+
+#A recorded Overpass response, served by a stand-in for the Overpass API
+RESPONSE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', '6f258c9317213184e487d9eec836dbd6a1fdd4ab.json')
+QUERY = {'north': 38.115, 'south': 38.085, 'east': -122.84, 'west': -122.88}
+#Queries reaching these longitudes fail, or hang until the test lets them go
+FAILING = {'north': 38.115, 'south': 38.085, 'east': -122.811, 'west': -122.88}
+HANGING = {'north': 38.115, 'south': 38.085, 'east': -122.822, 'west': -122.88}
+
+@pytest.fixture
+def overpass():
+    release = threading.Event()
+    requests = []
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+        def do_POST(self):
+            query = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())['data'][0]
+            requests.append(query)
+            if '-122.811' in query:
+                self.send_response(400)
+                self.end_headers()
+                return
+            if '-122.822' in query:
+                release.wait(30)
+            with open(RESPONSE, 'rb') as f:
+                body = f.read()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:%d/api' % server.server_port, requests, release
+    release.set()
+    server.shutdown()
+    #Refuse queries still on their way from workers that were left running
+    server.server_close()
+
+def _settings(endpoint, cache_folder):
+    return {
+        'overpass_endpoint': endpoint,
+        'overpass_rate_limit': False,
+        'use_cache': True,
+        'cache_folder': str(cache_folder),
+        'timeout': 10,
+    }
+
+def test_graphs_are_built_offline_from_cached_responses(overpass, tmp_path):
+    endpoint, requests, _ = overpass
+    settings = _settings(endpoint, tmp_path)
+    first = dict(generate.generate_graphs([(38.115, 38.085, -122.84, -122.88)], source='bbox', settings=settings, max_workers=1))
+    assert len(requests) == 1
+    #The same query in another form is served from the cache folder
+    second = list(generate.generate_graphs([QUERY, QUERY], source='bbox', settings=settings, max_workers=2))
+    assert len(requests) == 1
+    expected = list(first.values())[0].number_of_edges()
+    assert expected > 0
+    assert [graph.number_of_edges() for _, graph in second] == [expected, expected]
+
+def test_failure_does_not_wait_for_other_queries(overpass, tmp_path):
+    endpoint, _, release = overpass
+    graphs = generate.generate_graphs(
+        [FAILING, HANGING, HANGING, HANGING], source='bbox', settings=_settings(endpoint, tmp_path), max_workers=2,
+    )
+    start = time.time()
+    with pytest.raises(Exception):
+        list(graphs)
+    assert time.time() - start < 20
+    release.set()
+
+def test_closing_early_does_not_wait_for_other_queries(overpass, tmp_path):
+    endpoint, _, release = overpass
+    graphs = generate.generate_graphs(
+        [QUERY, HANGING, HANGING, HANGING], source='bbox', settings=_settings(endpoint, tmp_path), max_workers=2,
+    )
+    start = time.time()
+    query, graph = next(graphs)
+    assert query == QUERY
+    graphs.close()
+    assert time.time() - start < 20
+    release.set()
@@ -0,0 +1,36 @@
+import osmnx as ox
+import geometry
+from synthetic import synthetic_graph
+
+def _roads(**kwargs):
+    return geometry.make_road_list(synthetic_graph(200, **kwargs))
+
+def test_cache_hit_equals_fresh_conversion(tmp_path):
+    geometry.clear_linestring_cache()
+    fresh = geometry.convert_to_linestrings(_roads())
+    cold = geometry.convert_to_linestrings(_roads(), use_cache=True, cache_dir=str(tmp_path))
+    hit = geometry.convert_to_linestrings(_roads(), use_cache=True, cache_dir=str(tmp_path))
+    assert cold == fresh
+    assert hit == fresh
+    #Lists either way, and changing a hit does not change the cache
+    road = next(iter(hit[0]))
+    assert type(hit[0][road][0][0]) == list
+    hit[0][road][0][0].clear()
+    assert geometry.convert_to_linestrings(_roads(), use_cache=True)[0] == fresh[0]
+
+def test_disk_cache_hits_in_a_new_session(tmp_path):
+    geometry.clear_linestring_cache()
+    geometry.convert_to_linestrings(_roads(), use_cache=True, cache_dir=str(tmp_path))
+    geometry.clear_linestring_cache()
+    cached = len(list(tmp_path.iterdir()))
+    geometry.convert_to_linestrings(_roads(), use_cache=True, cache_dir=str(tmp_path))
+    assert len(list(tmp_path.iterdir())) == cached
+
+def test_moved_or_projected_graph_misses_the_cache():
+    geometry.clear_linestring_cache()
+    graph = synthetic_graph(200)
+    assert geometry.graph_fingerprint(graph) != geometry.graph_fingerprint(ox.project_graph(graph))
+    geometry.convert_to_linestrings(_roads(), use_cache=True)
+    moved, _ = geometry.convert_to_linestrings(_roads(north=39.5), use_cache=True)
+    assert moved == geometry.convert_to_linestrings(_roads(north=39.5))[0]
+    assert moved['Row 0 Road'][0][0][0] == (39.5, -122.9)
@@ -0,0 +1,50 @@
+import io
+import random
+from PIL import Image, ImageDraw
+import image_quality
+import image_store
+
+def _jpeg(image):
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+def _placeholder():
+    image = Image.new('RGB', (640, 640), (228, 227, 223))
+    ImageDraw.Draw(image).text((220, 310), 'Sorry, we have no imagery here.', fill=(100, 100, 100))
+    return image
+
+def _street(seed, brightness=0):
+    #Blocks of colour, so that the frame has structure for the hash to pick up
+    rng = random.Random(seed)
+    image = Image.new('RGB', (640, 640))
+    draw = ImageDraw.Draw(image)
+    for x in range(0, 640, 80):
+        for y in range(0, 640, 80):
+            draw.rectangle((x, y, x + 79, y + 79), fill=tuple(min(255, rng.randrange(200) + brightness) for _ in range(3)))
+    return image
+
+def _night():
+    #A dark frame is nearly as flat as the placeholder, only far darker
+    rng = random.Random(0)
+    image = Image.new('RGB', (640, 640), (18, 18, 22))
+    draw = ImageDraw.Draw(image)
+    for _ in range(20):
+        x, y = rng.randrange(640), rng.randrange(400, 640)
+        draw.ellipse((x, y, x + 6, y + 6), fill=(250, 230, 160))
+    return image
+
+def test_filter_rejects_placeholder_and_near_duplicate_but_keeps_dark_frame(tmp_path):
+    store_dir = str(tmp_path)
+    frames = [_placeholder(), _night(), _street(1), _street(1, brightness=4), _street(2)]
+    image_store.store_images(store_dir, [
+        {'image': _jpeg(frame), 'location': (38.0, -122.0 + n * 0.001), 'heading': 0, 'road': 'A', 'section': 0, 'offset': n * 10}
+        for n, frame in enumerate(frames)
+    ])
+    assert image_quality.is_placeholder(_placeholder())
+    assert not image_quality.is_placeholder(_night())
+    counts = image_quality.filter_images(store_dir, max_workers=1)
+    assert counts == {image_quality.PLACEHOLDER: 1, image_quality.NEAR_DUPLICATE: 1}
+    rows = image_store.find_images_by_road(store_dir, 'A', include_rejected=True)
+    assert [row['rejected'] for row in rows] == [image_quality.PLACEHOLDER, None, None, image_quality.NEAR_DUPLICATE, None]
+    assert [row['point_offset'] for row in image_store.find_images_by_road(store_dir, 'A')] == [10, 20, 40]
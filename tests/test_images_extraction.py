@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import pytest
+import requests
+import http_cache
+import image_store
+import images_extraction
+
+#Locations the stand-in Street View server treats specially
+TRUNCATED = '38.1,-122.1'
+UNSATISFIABLE = '38.2,-122.2'
+BROKEN = '38.3,-122.3'
+DENIED = '38.7,-122.7'
+NO_IMAGERY = '38.8,-122.8'
+
+def _image(location):
+    return ('image of %s ' % location).encode() * 20000
+
+@pytest.fixture
+def streetview(monkeypatch):
+    requests_seen = []
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+        def do_GET(self):
+            location = parse_qs(urlparse(self.path).query)['location'][0]
+            requested = self.headers.get('Range')
+            requests_seen.append((location, requested))
+            if urlparse(self.path).path.endswith('/metadata'):
+                self._metadata(location)
+                return
+            body = _image(location)
+            if location == BROKEN:
+                self.send_response(500)
+                self.end_headers()
+                return
+            start = int(requested[len('bytes='):-1]) if requested else 0
+            if start >= len(body) or location == UNSATISFIABLE:
+                self.send_response(416)
+                self.end_headers()
+                return
+            if start:
+                self.send_response(206)
+                self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(body) - 1, len(body)))
+            else:
+                self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(body) - start))
+            self.end_headers()
+            if location == TRUNCATED and not start:
+                #Drop the connection halfway through the first attempt
+                self.wfile.write(body[:len(body) // 2])
+                return
+            self.wfile.write(body[start:])
+        def _metadata(self, location):
+            if location == BROKEN:
+                self.send_response(500)
+                self.end_headers()
+                return
+            #Like the real API, errors about the request itself still come back with status 200
+            if location == DENIED:
+                metadata = {'status': 'REQUEST_DENIED'}
+            elif location == NO_IMAGERY:
+                metadata = {'status': 'ZERO_RESULTS'}
+            else:
+                lat, lon = location.split(',')
+                metadata = {'status': 'OK', 'pano_id': 'pano ' + location, 'date': '2022-05',
+                            'location': {'lat': float(lat), 'lng': float(lon)}}
+            body = json.dumps(metadata).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:%d/streetview?' % server.server_port
+    monkeypatch.setattr(images_extraction, 'PIC_BASE', url)
+    monkeypatch.setattr(images_extraction, 'META_BASE', 'http://127.0.0.1:%d/streetview/metadata?' % server.server_port)
+    yield url, requests_seen
+    server.shutdown()
+    server.server_close()
+
+def _params(location):
+    return {'location': location, 'heading': 0}
+
+def _partial_path(store_dir, url, location):
+    return os.path.join(store_dir, 'partial', images_extraction._request_name(url, _params(location)) + '.part')
+
+def test_truncated_download_is_resumed_with_range(streetview, tmp_path):
+    url, requests_seen = streetview
+    records = images_extraction.extract_images([{'location': (38.1, -122.1), 'heading': 90}], 'key', str(tmp_path))
+    body = _image(TRUNCATED)
+    assert records[0]['file_hash'] == hashlib.sha256(body).hexdigest()
+    assert [location for location, _ in requests_seen] == [TRUNCATED, TRUNCATED]
+    assert requests_seen[0][1] is None
+    #Resumed from whatever part of the first half made it to disk
+    assert 0 < int(requests_seen[1][1][len('bytes='):-1]) <= len(body) // 2
+    with open(image_store.image_path(str(tmp_path), records[0]['file_hash']), 'rb') as f:
+        assert f.read() == body
+
+def test_unsatisfiable_range_starts_over(streetview, tmp_path):
+    url, requests_seen = streetview
+    store_dir = str(tmp_path)
+    location = '38.4,-122.4'
+    body = _image(location)
+    os.makedirs(os.path.join(store_dir, 'partial'))
+    #A partial file longer than the image can only come from a different image
+    with open(_partial_path(store_dir, url, location), 'wb') as f:
+        f.write(b'x' * (len(body) + 10))
+    file_hash = images_extraction.download_image(url, _params(location), store_dir)
+    assert file_hash == hashlib.sha256(body).hexdigest()
+    assert requests_seen == [(location, 'bytes=%d-' % (len(body) + 10)), (location, None)]
+
+def test_unsatisfiable_range_without_partial_file_is_an_error(streetview, tmp_path):
+    url, requests_seen = streetview
+    #Without a partial file there is nothing to start over from, so the 416 is raised
+    with pytest.raises(requests.HTTPError):
+        images_extraction.download_image(url, _params(UNSATISFIABLE), str(tmp_path))
+    assert requests_seen == [(UNSATISFIABLE, None)]
+
+def test_failed_point_does_not_keep_others_from_being_indexed(streetview, tmp_path):
+    url, requests_seen = streetview
+    points = [
+        {'location': (38.5, -122.5), 'heading': 0, 'road': 'A'},
+        {'location': (38.3, -122.3), 'heading': 0, 'road': 'B'},
+        {'location': '38.6,-122.6', 'heading': 0, 'road': 'C'},
+    ]
+    records = images_extraction.extract_images(points, 'key', str(tmp_path), retries=1)
+    assert [('file_hash' in record, 'error' in record) for record in records] == [(True, False), (False, True), (True, False)]
+    assert [location for location, _ in requests_seen].count(BROKEN) == 2
+    connection = image_store.open_manifest(str(tmp_path))
+    try:
+        rows = connection.execute('SELECT road, lat, lon FROM images ORDER BY road').fetchall()
+    finally:
+        connection.close()
+    assert [tuple(row) for row in rows] == [('A', 38.5, -122.5), ('C', 38.6, -122.6)]
+
+def test_location_that_is_not_lat_lon_is_rejected_before_downloading(streetview, tmp_path):
+    url, requests_seen = streetview
+    with pytest.raises(ValueError):
+        images_extraction.extract_images(
+            [{'location': (38.5, -122.5), 'heading': 0}, {'location': 'Main St', 'heading': 0}], 'key', str(tmp_path),
+        )
+    assert requests_seen == []
+
+def test_record_then_replay_offline(streetview, tmp_path, monkeypatch):
+    url, requests_seen = streetview
+    cache_path = str(tmp_path / 'cache.sqlite')
+    opened = []
+    open_cache = http_cache.open_cache
+    monkeypatch.setattr(http_cache, 'open_cache', lambda path: opened.append(path) or open_cache(path))
+    points = [{'location': (38.5, -122.5), 'heading': 0}, {'location': (38.6, -122.6), 'heading': 90},
+              {'location': NO_IMAGERY, 'heading': 0}, {'location': DENIED, 'heading': 0}]
+    recorded = images_extraction.find_image_metadata(points, 'key', cache_path=cache_path)
+    assert [point['status'] for point in recorded] == ['OK', 'OK', 'ZERO_RESULTS', 'REQUEST_DENIED']
+    images = images_extraction.extract_images(points[:2], 'key', str(tmp_path / 'store'), cache_path=cache_path)
+    #The cache is opened and brought up to date once per call, not once per request
+    assert opened == [cache_path, cache_path]
+    seen = len(requests_seen)
+    assert images_extraction.find_image_metadata(points[:3], 'key', cache_path=cache_path, cache_mode='replay') == recorded[:3]
+    replayed = images_extraction.extract_images(points[:2], 'key', str(tmp_path / 'store'), cache_path=cache_path, cache_mode='replay')
+    assert replayed == images
+    assert len(requests_seen) == seen
+    #A denied request was not cached, so it cannot be replayed and is asked again when recording
+    with pytest.raises(LookupError):
+        images_extraction.find_image_metadata(points[3:], 'key', cache_path=cache_path, cache_mode='replay')
+    images_extraction.find_image_metadata(points[3:], 'key', cache_path=cache_path)
+    assert requests_seen[seen:] == [(DENIED, None)]
+
+@pytest.mark.parametrize('cached', [False, True])
+def test_metadata_http_error_is_raised_with_or_without_cache(streetview, tmp_path, cached):
+    url, requests_seen = streetview
+    cache_path = str(tmp_path / 'cache.sqlite') if cached else None
+    with pytest.raises(requests.HTTPError):
+        images_extraction.find_image_metadata([{'location': BROKEN}], 'key', cache_path=cache_path)
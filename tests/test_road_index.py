@@ -0,0 +1,70 @@
+import networkx as nx
+import pytest
+import geometry
+import road_index
+from synthetic import synthetic_graph
+
+@pytest.mark.parametrize('name, normalized', [
+    ('CA-116', 'sr 116'),
+    ('State Route 116', 'sr 116'),
+    ('Hwy 116', 'sr 116'),
+    ('Highway 116', 'sr 116'),
+    ('US Highway 101', 'us 101'),
+    ('U.S. 101', 'us 101'),
+    ('I-80', 'i 80'),
+    ('County Road 12', 'cr 12'),
+    ('North Main Street', 'n main st'),
+    ('Sir Francis Drake Boulevard', 'sir francis drake blvd'),
+    ('Great Highway', 'great hwy'),
+])
+def test_normalize_road_name(name, normalized):
+    assert road_index.normalize_road_name(name) == normalized
+
+def _graph():
+    graph = nx.MultiDiGraph()
+    for n in range(10):
+        graph.add_node(n, x=n, y=0)
+    graph.add_edge(0, 1, name='Main Street', ref='CA 116')
+    graph.add_edge(1, 2, name=['Main St', 'Gravenstein Highway'], ref='SR 116;SR 12')
+    graph.add_edge(2, 3, name='Maine Street')
+    graph.add_edge(3, 4, ref='SR 16')
+    graph.add_edge(4, 5, name='Row 12 Road')
+    graph.add_edge(5, 6, name='Row 92 Road')
+    graph.add_edge(6, 7, name='Mission Street')
+    return graph
+
+def test_exact_and_prefix_queries():
+    index = road_index.build_road_index(_graph())
+    assert road_index.find_road_edges(index, 'main st') == {(0, 1, 0), (1, 2, 0)}
+    assert road_index.find_road_edges(index, 'Hwy 116') == {(0, 1, 0), (1, 2, 0)}
+    assert road_index.find_road_edges(index, 'Route 12') == set()
+    assert road_index.find_road_names(index, 'State Route 12') == ['sr 12']
+    assert road_index.find_road_names(index, 'Mai', 'prefix') == ['main st', 'maine st']
+    with pytest.raises(ValueError):
+        road_index.find_road_names(index, 'Main', 'regex')
+
+def test_fuzzy_queries_only_match_the_same_numbers():
+    index = road_index.build_road_index(_graph())
+    assert road_index.find_road_names(index, 'Mian Street', 'fuzzy') == ['main st', 'maine st']
+    assert road_index.find_road_names(index, 'Row 12 Rd', 'fuzzy') == ['row 12 rd']
+    assert road_index.find_road_names(index, 'Row 13 Rd', 'fuzzy') == []
+    assert road_index.find_road_names(index, 'SR 116', 'fuzzy') == ['sr 116']
+    assert road_index.find_road_names(index, 'SR 16', 'fuzzy') == ['sr 16']
+    isolated = road_index.isolate_road(_graph(), index, 'sr 16', mode='fuzzy')
+    assert list(isolated.edges(keys=True)) == [(3, 4, 0)]
+
+def test_make_road_list_keeps_each_spelling_of_a_name_apart():
+    roads = geometry.make_road_list(_graph())
+    assert sorted(roads) == ['Gravenstein Highway', 'Main St', 'Main Street', 'Maine Street', 'Mission Street', 'Row 12 Road', 'Row 92 Road']
+    assert list(roads['Main Street'].edges(keys=True)) == [(0, 1, 0)]
+    assert list(roads['Main St'].edges(keys=True)) == [(1, 2, 0)]
+    assert list(roads['Gravenstein Highway'].edges(keys=True)) == [(1, 2, 0)]
+
+def test_make_road_list_walks_roads_in_graph_order():
+    graph = synthetic_graph(400)
+    roads = geometry.make_road_list(graph)
+    assert len(roads) == 30
+    for name, road in roads.items():
+        assert list(road.nodes) == [n for n in graph if n in road]
+        assert all(data['name'] == name for _, _, data in road.edges(data=True))
+        assert road.number_of_edges() == sum(1 for _, _, n in graph.edges(data='name') if n == name)
@@ -0,0 +1,23 @@
+import scaling
+
+def _measurements(stage, seconds):
+    return {n: {stage: {'seconds': s, 'peak_mb': n / 1000}} for n, s in seconds}
+
+def test_quadratic_stage_breaks_its_ceiling_without_a_budget():
+    #make_road_list when it deep-copied the graph once per road
+    measurements = _measurements('make_road_list', [(1000, 1.9), (2000, 6.2), (5000, 29.8), (10000, 89.3)])
+    summary = scaling.summarize(measurements)
+    budgets = {'make_road_list': dict(summary['make_road_list'])}
+    failures = scaling.check(summary, measurements, budgets, 2, 0.3)
+    assert failures == ['make_road_list time_exponent is 1.68, above its ceiling of 1.25']
+    allowed = dict(scaling.COMPLEXITY_CEILINGS, make_road_list=1.7)
+    assert scaling.check(summary, measurements, budgets, 2, 0.3, allowed) == []
+
+def test_linear_stage_is_held_to_its_budget():
+    measurements = _measurements('truncate', [(2000, 0.1), (20000, 1.0), (100000, 5.0)])
+    summary = scaling.summarize(measurements)
+    budgets = {'truncate': dict(summary['truncate'], seconds={'2000': 0.1, '20000': 0.4, '100000': 2.0})}
+    assert scaling.check(summary, measurements, budgets, 2, 0.3) == [
+        'truncate at 20000 edges took 1.00s, budget 0.80s',
+        'truncate at 100000 edges took 5.00s, budget 4.00s',
+    ]
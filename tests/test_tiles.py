@@ -0,0 +1,109 @@
+import ast
+import json
+import os
+import subprocess
+import sys
+import time
+from shapely.geometry import box
+import generate
+import geometry
+import interpolate_road
+import tiles
+import truncate
+from synthetic import synthetic_graph, write_osm_xml
+
+NORTH, SOUTH, EAST, WEST = 38.5, 38.48, -122.88, -122.9
+
+def _segments(sections):
+    """
+    Every piece of road between two consecutive points, in either direction.
+    """
+    found = set()
+    for road in sections:
+        for paths in sections[road]:
+            for path in paths:
+                for a, b in zip(path, path[1:]):
+                    found.add((road, min(tuple(a), tuple(b)), max(tuple(a), tuple(b))))
+    return found
+
+def test_sharded_run_matches_unsharded_run(tmp_path):
+    osm_path = str(tmp_path / 'grid.osm')
+    write_osm_xml(synthetic_graph(800, north=NORTH, west=WEST), osm_path)
+    graph = generate.generate_graph_from_xml_file(osm_path, retain_all=True)
+    graph = truncate.truncate_to_polygon(graph, box(WEST, SOUTH, EAST, NORTH), retain_all=True)
+    expected, _ = geometry.convert_to_linestrings(geometry.make_road_list(graph))
+    expected_points = interpolate_road.interpolate_roads_multi(expected, [50])[50]
+
+    queue_dir = str(tmp_path / 'queue')
+    queued = tiles.create_work_queue(
+        queue_dir, NORTH, SOUTH, EAST, WEST, tile_size=0.005, distance=50, buffer=0.002, osm_path=osm_path,
+    )
+    assert len(queued) > 4
+    script = os.path.join(os.path.dirname(tiles.__file__), 'tiles.py')
+    workers = [
+        subprocess.Popen([sys.executable, script, queue_dir], stdout=subprocess.PIPE, text=True)
+        for _ in range(3)
+    ]
+    done = []
+    for worker in workers:
+        out, _ = worker.communicate(timeout=300)
+        assert worker.returncode == 0
+        done.extend(ast.literal_eval(out))
+    #Every tile was run by exactly one worker
+    assert sorted(done) == sorted(queued)
+
+    sections, points, missing = tiles.merge_results(queue_dir)
+    assert missing == []
+    assert len(_segments(expected)) > 1000
+    assert _segments(sections) == _segments(expected)
+    assert sections == expected
+    assert points == {road: list(expected_points[road]) for road in expected_points}
+
+def test_worker_loads_only_as_far_as_its_roads_reach(tmp_path, monkeypatch):
+    #Every road is three blocks long, so no road runs more than 0.003 degrees past a tile
+    graph = synthetic_graph(800, north=NORTH, west=WEST)
+    for u, v, data in graph.edges(data=True):
+        data['name'] = '%s %d' % (data['name'], min(u, v) % 21 // 3 if 'Row' in data['name'] else min(u, v) // 21 // 3)
+    osm_path = str(tmp_path / 'grid.osm')
+    write_osm_xml(graph, osm_path)
+    graph = generate.generate_graph_from_xml_file(osm_path, retain_all=True)
+    graph = truncate.truncate_to_polygon(graph, box(WEST, SOUTH, EAST, NORTH), retain_all=True)
+    expected, _ = geometry.convert_to_linestrings(geometry.make_road_list(graph))
+
+    loaded = []
+    trim_to_bounds = tiles._trim_to_bounds
+    def record(graph, bounds, region):
+        loaded.append(bounds)
+        return trim_to_bounds(graph, bounds, region)
+    monkeypatch.setattr(tiles, '_trim_to_bounds', record)
+    queue_dir = str(tmp_path / 'queue')
+    queued = tiles.create_work_queue(
+        queue_dir, NORTH, SOUTH, EAST, WEST, tile_size=0.005, distance=50, buffer=0.002, osm_path=osm_path,
+    )
+    assert sorted(tiles.run_worker(queue_dir, 'worker')) == sorted(queued)
+    #Tiles with roads running past the first buffer grow it once, and none load the whole region
+    assert all((north - south) < 0.005 + 2 * 0.004 + 1e-9 for north, south, _, _ in loaded)
+    assert len(loaded) > len(queued)
+    sections, _, missing = tiles.merge_results(queue_dir)
+    assert missing == []
+    assert sections == expected
+
+def test_expired_lease_is_taken_over_once(tmp_path):
+    queue_dir = str(tmp_path / 'queue')
+    tiles.create_work_queue(queue_dir, 0.05, 0.0, 0.05, 0.0)
+    assert tiles.claim_tile(queue_dir, 'a', lease_seconds=0.2)['tile'] == '0_0'
+    assert tiles.claim_tile(queue_dir, 'b', lease_seconds=0.2) is None
+    time.sleep(0.3)
+    #The stalled holder can no longer renew once its lease is taken over
+    assert tiles.claim_tile(queue_dir, 'b', lease_seconds=0.2)['tile'] == '0_0'
+    assert tiles.claim_tile(queue_dir, 'c', lease_seconds=0.2) is None
+    assert not tiles.renew_lease(queue_dir, '0_0', 'a')
+    assert tiles.renew_lease(queue_dir, '0_0', 'b')
+    #Finishing late must not free the lease of the worker that took over
+    tiles.complete_tile(queue_dir, '0_0', {'tile': '0_0', 'sections': [], 'points': []}, 'a')
+    lease_dir = os.path.join(queue_dir, 'leases', '0_0')
+    holders = []
+    for name in os.listdir(lease_dir):
+        with open(os.path.join(lease_dir, name)) as f:
+            holders.append(json.load(f)['worker'])
+    assert holders == ['b']